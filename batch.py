@@ -0,0 +1,313 @@
+"""
+Run the rewrite and analysis pipeline over a batch of essays.
+
+Input is a JSONL file with one object per line (`id` plus any of `essay`,
+`source_text` and `essay_prompt`) or a directory of .txt essays. Items
+with a prompt and source text but no essay are rewritten first; every
+essay then goes through every analyzer with the same prompts and
+schemas as the web routes. Results are appended to a JSONL file or a
+SQLite database (.db/.sqlite) as each item finishes. Re-running with the
+same output skips items that already finished, so a crashed or
+interrupted run resumes where it stopped:
+
+    python batch.py essays.jsonl --output results.jsonl --workers 16
+    python batch.py essays/ --source chapter3.txt --output results.db
+
+For cheaper offline runs, write the pending requests in OpenAI Batch API
+format, submit that file, then load its output back into the response
+cache and finish the run from it:
+
+    python batch.py essays.jsonl --emit-batch batch_input.jsonl
+    python batch.py essays.jsonl --ingest-batch batch_output.jsonl --output results.jsonl
+
+Essays that have to be written first need a second round for their
+analyses: `--ingest-batch batch_output.jsonl --emit-batch round2.jsonl`
+loads the rewrites and writes the requests that depend on them.
+"""
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import json
+import os
+import sys
+import time
+
+from chatgpt_api import (
+    ANALYZER_MODEL, ANALYZERS, rewrite_messages, rewrite_response_format,
+    collect_edits, create_completion, llm_cache, parse_completion
+)
+from db import Database
+from llm_cache import cache_key
+
+# Model used by the /rewrite routes
+REWRITE_MODEL = "gpt-4o-mini"
+
+
+def load_items(path, source_text=None, essay_prompt=None):
+    """Read batch items from a JSONL file or a directory of .txt essays."""
+    items = []
+    if os.path.isdir(path):
+        for name in sorted(os.listdir(path)):
+            if name.endswith('.txt'):
+                with open(os.path.join(path, name), encoding='utf-8') as f:
+                    items.append({"id": name[:-len('.txt')], "essay": f.read()})
+    else:
+        with open(path, encoding='utf-8') as f:
+            for line_number, line in enumerate(f, 1):
+                if line.strip():
+                    item = json.loads(line)
+                    item.setdefault("id", str(line_number))
+                    item["id"] = str(item["id"])
+                    items.append(item)
+
+    # Command-line source text and prompt apply to items that don't have their own
+    for item in items:
+        if source_text is not None:
+            item.setdefault("source_text", source_text)
+        if essay_prompt is not None:
+            item.setdefault("essay_prompt", essay_prompt)
+    return items
+
+
+def needs_rewrite(item):
+    return not item.get("essay") and bool(item.get("essay_prompt"))
+
+
+def analyzer_requests(item, essay):
+    """
+    Return (route, model, messages, response_format) for every analyzer of
+    one essay that needs the model (simplify may settle an essay locally).
+    """
+    requests = []
+    for name, analyzer in ANALYZERS.items():
+        messages = analyzer.messages(essay, item.get("source_text"))
+        if messages is not None:
+            requests.append((name, ANALYZER_MODEL, messages, analyzer.response_format))
+    return requests
+
+
+def rewrite_request(item):
+    return "rewrite", REWRITE_MODEL, rewrite_messages(item.get("source_text"), item["essay_prompt"]), rewrite_response_format
+
+
+def cached_rewrite(item):
+    """The rewritten essay for an item if it is already in the response cache."""
+    _, model, messages, response_format = rewrite_request(item)
+    content = llm_cache.get(cache_key(model, messages, response_format))
+    return json.loads(content).get('final_answer') if content is not None else None
+
+
+def process_item(item, analysis_executor, use_cache=True):
+    """Run one item through the pipeline and return its result record."""
+    record = {"id": item["id"], "errors": {}}
+    essay = item.get("essay")
+
+    if needs_rewrite(item):
+        _, model, messages, response_format = rewrite_request(item)
+        try:
+            content = create_completion(messages, model, response_format, use_cache=use_cache, route="rewrite")
+            essay = parse_completion(content, "rewrite").get('final_answer', "")
+            record["rewrite"] = essay
+        except Exception as e:
+            record["errors"]["rewrite"] = str(e)
+            return record
+
+    record["essay"] = essay
+    if not essay:
+        record["errors"]["essay"] = "Item has no essay and no essay_prompt to write one"
+        return record
+
+    # The analyses of one essay run side by side, as in /evaluate
+    futures = {
+        name: analysis_executor.submit(analyzer.run, essay, item.get("source_text"), use_cache=use_cache)
+        for name, analyzer in ANALYZERS.items()
+    }
+    results = {route: future.result() for route, future in futures.items()}
+
+    for route, result in results.items():
+        if result.get("error"):
+            record["errors"][route] = result["error"]
+    record["edits"] = collect_edits(essay, results)
+    return record
+
+
+class JSONLSink:
+    """Appends one JSON line per finished item; the file doubles as the checkpoint."""
+
+    def __init__(self, path):
+        self.path = path
+        self.finished = set()
+
+        if os.path.exists(path):
+            with open(path, 'rb+') as f:
+                data = f.read()
+                # Drop a line cut short by a crash so new lines start cleanly
+                end = data.rfind(b'\n') + 1
+                if end < len(data):
+                    f.truncate(end)
+                for line in data[:end].splitlines():
+                    record = json.loads(line)
+                    if record.get("errors"):
+                        self.finished.discard(record["id"])
+                    else:
+                        self.finished.add(record["id"])
+
+        self.file = open(path, 'a', encoding='utf-8')
+
+    def write(self, record):
+        self.file.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        self.file.close()
+
+
+class SQLiteSink:
+    """Stores one row per item, replaced if the item is run again."""
+
+    def __init__(self, path):
+        self.db = Database(path)
+        self.db.init()
+        self.db.execute('''
+            CREATE TABLE IF NOT EXISTS batch_results (
+                id TEXT PRIMARY KEY,
+                result TEXT NOT NULL,
+                failed INTEGER NOT NULL,
+                finished_at REAL NOT NULL
+            )
+        ''')
+        self.finished = {row["id"] for row in self.db.fetchall('SELECT id FROM batch_results WHERE failed = 0')}
+
+    def write(self, record):
+        self.db.execute(
+            'INSERT OR REPLACE INTO batch_results (id, result, failed, finished_at) VALUES (?, ?, ?, ?)',
+            (record["id"], json.dumps(record, ensure_ascii=False), int(bool(record["errors"])), time.time())
+        )
+
+    def close(self):
+        self.db.close()
+
+
+def open_sink(path):
+    if path.endswith(('.db', '.sqlite', '.sqlite3')):
+        return SQLiteSink(path)
+    return JSONLSink(path)
+
+
+def emit_batch(items, path):
+    """Write every uncached request for the items' next step as Batch API input."""
+    count = 0
+    with open(path, 'w', encoding='utf-8') as f:
+        for item in items:
+            if needs_rewrite(item):
+                essay = cached_rewrite(item)
+                requests = [rewrite_request(item)] if essay is None else analyzer_requests(item, essay)
+            else:
+                requests = analyzer_requests(item, item.get("essay") or "")
+            for route, model, messages, response_format in requests:
+                if llm_cache.get(cache_key(model, messages, response_format)) is not None:
+                    continue
+                f.write(json.dumps({
+                    "custom_id": f"{item['id']}/{route}",
+                    "method": "POST",
+                    "url": "/v1/chat/completions",
+                    "body": {"model": model, "messages": messages, "response_format": response_format},
+                }, ensure_ascii=False) + '\n')
+                count += 1
+    return count
+
+
+def ingest_batch(items, path):
+    """Load Batch API output into the response cache so the run can use it offline."""
+    contents = {}
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            line = json.loads(line)
+            response = line.get("response") or {}
+            if line.get("error") or response.get("status_code") != 200:
+                continue
+            contents[line["custom_id"]] = response["body"]["choices"][0]["message"]["content"]
+
+    count = 0
+    for item in items:
+        requests = []
+        if needs_rewrite(item):
+            _, model, messages, response_format = rewrite_request(item)
+            content = contents.get(f"{item['id']}/rewrite")
+            if content is not None:
+                llm_cache.set(cache_key(model, messages, response_format), content)
+                count += 1
+            essay = cached_rewrite(item)
+            if essay is not None:
+                requests = analyzer_requests(item, essay)
+        elif item.get("essay"):
+            requests = analyzer_requests(item, item["essay"])
+
+        for route, model, messages, response_format in requests:
+            content = contents.get(f"{item['id']}/{route}")
+            if content is not None:
+                llm_cache.set(cache_key(model, messages, response_format), content)
+                count += 1
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('input', help="JSONL file of items, or a directory of .txt essays")
+    parser.add_argument('--output', default='batch_results.jsonl', help="results file: .jsonl, or .db/.sqlite")
+    parser.add_argument('--workers', type=int, default=8, help="items processed at once")
+    parser.add_argument('--source', help="source text file for items without their own source_text")
+    parser.add_argument('--prompt', help="essay prompt for items without their own essay_prompt")
+    parser.add_argument('--no-cache', action='store_true', help="skip the LLM response cache")
+    parser.add_argument('--ingest-batch', metavar='FILE', help="load Batch API output before running")
+    parser.add_argument('--emit-batch', metavar='FILE', help="write pending requests as Batch API input and exit")
+    args = parser.parse_args()
+
+    source_text = None
+    if args.source:
+        with open(args.source, encoding='utf-8') as f:
+            source_text = f.read()
+    items = load_items(args.input, source_text, args.prompt)
+
+    if args.ingest_batch:
+        print(f"Loaded {ingest_batch(items, args.ingest_batch)} responses from {args.ingest_batch}")
+    if args.emit_batch:
+        print(f"Wrote {emit_batch(items, args.emit_batch)} requests to {args.emit_batch}")
+        return
+
+    sink = open_sink(args.output)
+    pending = [item for item in items if item["id"] not in sink.finished]
+    print(f"{len(items) - len(pending)} of {len(items)} items already done, {len(pending)} to run")
+
+    failed = 0
+    executor = ThreadPoolExecutor(max_workers=args.workers)
+    analysis_executor = ThreadPoolExecutor(max_workers=args.workers * len(ANALYZERS))
+    try:
+        futures = {
+            executor.submit(process_item, item, analysis_executor, not args.no_cache): item
+            for item in pending
+        }
+        for done, future in enumerate(as_completed(futures), 1):
+            record = future.result()
+            sink.write(record)
+            if record["errors"]:
+                failed += 1
+            status = "failed: " + ", ".join(record["errors"]) if record["errors"] else f"{len(record['edits'])} edits"
+            print(f"[{done}/{len(pending)}] {record['id']} {status}")
+    except KeyboardInterrupt:
+        print("Interrupted; finished items are saved and will be skipped next run")
+        executor.shutdown(wait=False, cancel_futures=True)
+        analysis_executor.shutdown(wait=False, cancel_futures=True)
+        sink.close()
+        sys.exit(130)
+
+    executor.shutdown()
+    analysis_executor.shutdown()
+    sink.close()
+    print(f"Done: {len(pending) - failed} succeeded, {failed} failed (re-run to retry failures)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+"""
+Benchmark the app's endpoints against a local mock of the OpenAI API.
+
+Starts mock_openai.py and the Flask app in-process, points the OpenAI
+client at the mock through OPENAI_BASE_URL, then drives each endpoint at a
+fixed concurrency with essays of increasing size. Reports p50/p95/p99
+latency and requests/sec per endpoint and size, and saves them as JSON so
+runs can be compared:
+
+    python benchmark.py --concurrency 16 --requests 64 --sizes 250 1000 4000
+"""
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+import httpx
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+from mock_openai import MockConfig, start_server
+
+VOCABULARY = (
+    "cells energy mitochondria nucleus protein membrane organism tissue function structure process "
+    "evidence analysis scientists discovered important because however therefore although complex "
+    "system growth division genetic information transport oxygen respiration photosynthesis plants"
+).split()
+
+ANALYZERS = ['/simplify', '/exemplify', '/factcheck', '/assert', '/clarify']
+DEFAULT_ENDPOINTS = ['/rewrite'] + ANALYZERS + ['/evaluate', '/store-edits', '/track-edits', '/get-edits', '/get-segments']
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+def make_essay(words, seed=0):
+    """Deterministic essay of roughly `words` words, split into paragraphs."""
+    rng = random.Random(seed)
+    paragraphs = []
+    while words > 0:
+        size = min(words, 80)
+        sentence_words = [rng.choice(VOCABULARY) for _ in range(size)]
+        paragraphs.append(' '.join(sentence_words).capitalize() + '.')
+        words -= size
+    return '\n\n'.join(paragraphs)
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    index = min(len(ordered) - 1, max(0, round(fraction * len(ordered)) - 1))
+    return ordered[index]
+
+
+def build_request(endpoint, essay, sequence, use_cache):
+    """Return (method, json body) for one request to endpoint."""
+    if endpoint == '/rewrite':
+        return 'POST', {"source_text": essay, "essay_prompt": "Explain how cells get energy.", "no_cache": not use_cache}
+    if endpoint in ANALYZERS or endpoint == '/evaluate':
+        return 'POST', {"essay": essay, "source_text": essay, "no_cache": not use_cache}
+    if endpoint == '/store-edits':
+        return 'POST', {"edits": [{
+            "type": "simplify",
+            "phrase": "mitochondria",
+            "suggestion": "energy makers",
+            "reasoning": "benchmark",
+            "startIndex": sequence * 10,
+            "endIndex": sequence * 10 + 5,
+        }]}
+    if endpoint == '/track-edits':
+        # Every call types one more word at the end of the worker's essay
+        return 'POST', {"responseBoxText": essay + " word" * sequence}
+    return 'GET', None
+
+
+def run_endpoint(base_url, endpoint, essay, concurrency, requests, use_cache):
+    """Send `requests` requests to one endpoint from `concurrency` workers."""
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+    counter = iter(range(requests))
+
+    def worker(worker_id):
+        nonlocal errors
+        # Each worker is its own user session
+        with httpx.Client(base_url=base_url, timeout=300, headers={"X-Session-Id": uuid.uuid4().hex}) as http:
+            sequence = 0
+            while True:
+                with lock:
+                    if next(counter, None) is None:
+                        return
+                sequence += 1
+                method, body = build_request(endpoint, essay, sequence, use_cache)
+                start = time.perf_counter()
+                try:
+                    response = http.request(method, endpoint, json=body)
+                    response.read()
+                    ok = response.status_code < 400
+                except httpx.HTTPError:
+                    ok = False
+                elapsed = time.perf_counter() - start
+                with lock:
+                    latencies.append(elapsed)
+                    if not ok:
+                        errors += 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(worker, range(concurrency)))
+    wall = time.perf_counter() - start
+
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "p50": percentile(latencies, 0.50),
+        "p95": percentile(latencies, 0.95),
+        "p99": percentile(latencies, 0.99),
+        "mean": sum(latencies) / len(latencies) if latencies else None,
+        "rps": len(latencies) / wall if wall else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=32, help="requests per endpoint and essay size")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[250, 1000, 4000], help="essay sizes in words")
+    parser.add_argument('--endpoints', nargs='+', default=DEFAULT_ENDPOINTS)
+    parser.add_argument('--latency', type=float, default=0.2, help="mock upstream latency in seconds")
+    parser.add_argument('--jitter', type=float, default=0.05, help="mock upstream jitter in seconds")
+    parser.add_argument('--findings', type=int, default=3, help="findings per mock analyzer response")
+    parser.add_argument('--cache', action='store_true', help="allow the LLM response cache (off by default)")
+    parser.add_argument('--output', default='benchmark_results.json')
+    args = parser.parse_args()
+    output = os.path.abspath(args.output)
+
+    mock = start_server(MockConfig(args.latency, args.jitter, args.findings))
+    os.environ['OPENAI_BASE_URL'] = f"http://127.0.0.1:{mock.server_port}/v1"
+    os.environ.setdefault('OPENAI_API_KEY', 'benchmark')
+    # Sessions are picked by header so each worker is its own user without cookies
+    os.environ['SESSION_HEADER'] = '1'
+
+    # Import the app from a scratch directory so the benchmark gets its own edits.db
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    os.chdir(tempfile.mkdtemp(prefix='rewrite-bench-'))
+    from chatgpt_api import app
+
+    server = make_server('127.0.0.1', 0, app, threaded=True, request_handler=QuietRequestHandler)
+    threading.Thread(target=server.serve_forever, name='app', daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_port}"
+
+    results = []
+    print(f"{'endpoint':<14}{'words':>7}{'reqs':>6}{'errs':>6}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'req/s':>9}")
+    for size in args.sizes:
+        essay = make_essay(size, seed=size)
+        for endpoint in args.endpoints:
+            stats = run_endpoint(base_url, endpoint, essay, args.concurrency, args.requests, args.cache)
+            results.append(dict(stats, endpoint=endpoint, words=size))
+            print(f"{endpoint:<14}{size:>7}{stats['requests']:>6}{stats['errors']:>6}"
+                  f"{stats['p50'] * 1000:>10.1f}{stats['p95'] * 1000:>10.1f}{stats['p99'] * 1000:>10.1f}{stats['rps']:>9.1f}")
+
+    server.shutdown()
+    mock.shutdown()
+
+    with open(output, 'w') as f:
+        json.dump({
+            "config": {
+                "concurrency": args.concurrency,
+                "requests": args.requests,
+                "sizes": args.sizes,
+                "latency": args.latency,
+                "jitter": args.jitter,
+                "findings": args.findings,
+                "cache": args.cache,
+            },
+            "created": time.strftime('%Y-%m-%dT%H:%M:%S'),
+            "results": results,
+        }, f, indent=2)
+    print(f"Saved results to {output}")
+
+
+if __name__ == "__main__":
+    main()
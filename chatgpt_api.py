@@ -1,20 +1,217 @@
-from flask import Flask, render_template, request, jsonify
-import json
+from flask import Flask, render_template, request, jsonify, session, g, Response, stream_with_context
 from textwrap import dedent
-from openai import OpenAI
+from openai import OpenAI, DefaultHttpxClient
+import httpx
 import os
 from dotenv import load_dotenv
-import sqlite3
-import difflib
+import atexit
+import uuid
+import time
+import threading
+import hashlib
+import hmac
+import re
+from bisect import bisect_right
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from spans import resolve_spans, segment_spans, split_paragraphs
+from llm_cache import LRUCache, ResponseCache, SingleFlight, cache_key
+from streaming import JSONStringFieldExtractor, sse_event
+from db import Database, WriteBehindWriter
+from retrieval import chunk_passages, estimate_tokens, select_passages, split_sentences
+from metrics import Registry
+from scheduler import BACKGROUND, INTERACTIVE, TokenBucket, UpstreamScheduler
+from responses import FastJSONProvider, compress_response, dumps, loads
+from lexicon import load_lexicon, screen_words
 
 app = Flask(__name__)
+# orjson for jsonify, jiter for request bodies
+app.json = FastJSONProvider(app)
 
 load_dotenv('api_key.env')
+
+# Signs the session cookie that identifies each user's document
+app.secret_key = os.getenv("FLASK_SECRET_KEY") or os.urandom(32)
+
 api_key = os.getenv("OPENAI_API_KEY")
 if api_key is None:
     raise ValueError("API key not found. Please set it in the .env file.")
 
-client = OpenAI(api_key = os.getenv("OPENAI_API_KEY"))
+####### METRICS #######
+# Directory shared by all worker processes (gunicorn.conf.py sets one) so
+# /metrics reports their combined values; unset, each process reports its own
+METRICS_DIR = os.getenv("METRICS_DIR")
+# Seconds between snapshots of this process's metrics to METRICS_DIR
+METRICS_WRITE_INTERVAL = 5
+
+metrics = Registry(METRICS_DIR)
+upstream_latency = metrics.histogram(
+    'rewrite_upstream_latency_seconds', 'Latency of chat completion calls.', ('route', 'model'))
+upstream_first_token = metrics.histogram(
+    'rewrite_upstream_first_token_seconds', 'Time to the first streamed token.', ('route', 'model'))
+upstream_tokens = metrics.counter(
+    'rewrite_upstream_tokens_total', 'Tokens used by chat completion calls.', ('route', 'model', 'kind'))
+upstream_errors = metrics.counter(
+    'rewrite_upstream_errors_total', 'Chat completion calls that failed.', ('route', 'model', 'error'))
+upstream_retries = metrics.counter(
+    'rewrite_upstream_retryable_responses_total', 'Upstream 429 and 5xx responses, which the client retries.', ('status',))
+upstream_queue_wait = metrics.histogram(
+    'rewrite_upstream_queue_seconds', 'Time calls waited for the upstream scheduler.', ('priority',))
+upstream_backoffs = metrics.counter(
+    'rewrite_upstream_backoffs_total', 'Upstream calls retried after backing off.', ('error',))
+upstream_coalesced = metrics.counter(
+    'rewrite_upstream_coalesced_total', 'Completions shared with an identical call already in flight.', ('route', 'model'))
+speculative_evaluations = metrics.counter(
+    'rewrite_speculative_evaluations_total', 'Background evaluations of rewritten essays by outcome.', ('result',))
+unresolved_phrases = metrics.counter(
+    'rewrite_unresolved_phrases_total', 'Analyzer phrases that could not be located in the essay.', ('route',))
+json_parse_latency = metrics.histogram(
+    'rewrite_json_parse_seconds', 'Time spent parsing model output.', ('route',))
+db_latency = metrics.histogram(
+    'rewrite_db_query_seconds', 'Latency of SQLite queries.', ('operation', 'statement'))
+request_latency = metrics.histogram(
+    'rewrite_http_request_duration_seconds', 'Latency of requests to this app.', ('endpoint', 'method', 'status'))
+
+# Add a Server-Timing header to every response (or send "X-Timing: 1" per request)
+TIMING_HEADERS = os.getenv("TIMING_HEADERS", "") == "1"
+
+# Response bodies at least this large are sent with gzip or brotli when the client accepts it
+COMPRESS_MIN_SIZE = int(os.getenv("COMPRESS_MIN_SIZE", "1024"))
+
+@app.before_request
+def start_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request(response):
+    elapsed = time.perf_counter() - g.request_start
+    request_latency.observe(elapsed, endpoint=request.endpoint or 'unknown', method=request.method, status=response.status_code)
+    if TIMING_HEADERS or request.headers.get('X-Timing') == '1':
+        response.headers['Server-Timing'] = f'app;dur={elapsed * 1000:.1f}'
+    return response
+
+@app.after_request
+def compress(response):
+    # Runs before record_request, so compression time counts towards request latency
+    return compress_response(response, request.accept_encodings, COMPRESS_MIN_SIZE)
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Expose metrics in the Prometheus text format."""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+def write_metrics_periodically():
+    while True:
+        time.sleep(METRICS_WRITE_INTERVAL)
+        try:
+            metrics.write_snapshot()
+        except Exception as e:
+            print(f"Error: {e}")
+
+if METRICS_DIR:
+    threading.Thread(target=write_metrics_periodically, name='metrics-writer', daemon=True).start()
+
+def count_retryable(response):
+    if response.status_code == 429 or response.status_code >= 500:
+        upstream_retries.inc(status=response.status_code)
+
+def record_usage(route, model, usage):
+    """Count the prompt, completion and cached prompt tokens of one call."""
+    if usage is None:
+        return
+    upstream_tokens.inc(usage.prompt_tokens, route=route, model=model, kind='prompt')
+    upstream_tokens.inc(usage.completion_tokens, route=route, model=model, kind='completion')
+    details = usage.prompt_tokens_details
+    if details is not None and details.cached_tokens:
+        upstream_tokens.inc(details.cached_tokens, route=route, model=model, kind='cached_prompt')
+
+def parse_completion(content, route):
+    """Parse a structured-output response, timing the parse."""
+    with json_parse_latency.time(route=route):
+        return loads(content)
+
+
+# One pooled HTTP client shared by every request; size the pool for the
+# number of LLM calls expected in flight at once. Retries are left to the
+# scheduler below so they count against the rate limits
+client = OpenAI(
+    api_key = os.getenv("OPENAI_API_KEY"),
+    max_retries=0,
+    http_client=DefaultHttpxClient(
+        event_hooks={'response': [count_retryable]},
+        limits=httpx.Limits(
+            max_connections=int(os.getenv("UPSTREAM_MAX_CONNECTIONS", "1000")),
+            max_keepalive_connections=int(os.getenv("UPSTREAM_KEEPALIVE_CONNECTIONS", "100"))
+        )
+    )
+)
+
+# Every upstream call is admitted by one scheduler that keeps us under the
+# account's rate limits; /rewrite goes ahead of evaluation fan-out
+scheduler = UpstreamScheduler(
+    requests_per_minute=int(os.getenv("UPSTREAM_RPM", "500")),
+    tokens_per_minute=int(os.getenv("UPSTREAM_TPM", "200000")),
+    max_concurrency=int(os.getenv("UPSTREAM_CONCURRENCY", "64")),
+    max_retries=int(os.getenv("UPSTREAM_MAX_RETRIES", "4")),
+    on_wait=lambda priority, seconds: upstream_queue_wait.observe(
+        seconds, priority="interactive" if priority == INTERACTIVE else "background"),
+    on_retry=lambda error, delay: upstream_backoffs.inc(error=type(error).__name__)
+)
+
+# Tokens reserved for the answer when a call is admitted; corrected from usage afterwards
+COMPLETION_TOKEN_ALLOWANCE = 500
+
+def estimate_request_tokens(messages):
+    return sum(estimate_tokens(message["content"]) for message in messages) + COMPLETION_TOKEN_ALLOWANCE
+
+def route_priority(route):
+    return INTERACTIVE if route == "rewrite" else BACKGROUND
+
+inflight = SingleFlight()
+
+def create_completion(messages, model, response_format, use_cache=True, route=None):
+    """
+    Return the message content of a chat completion, served from the response
+    cache when the same model, messages and response format were seen before.
+    """
+    key = cache_key(model, messages, response_format)
+    if use_cache:
+        content = llm_cache.get(key)
+        if content is not None:
+            return content
+
+    # Identical requests already in flight (a double-clicked Evaluate, two
+    # tabs on one essay) wait for that call instead of making their own
+    content, shared = inflight.do(key, partial(request_completion, key, messages, model, response_format, route))
+    if shared:
+        upstream_coalesced.inc(route=route, model=model)
+    return content
+
+def request_completion(key, messages, model, response_format, route):
+    """Make the upstream call for create_completion and cache its content."""
+    def attempt():
+        with upstream_latency.time(route=route, model=model):
+            return client.chat.completions.create(
+                messages=messages,
+                model=model,
+                response_format=response_format
+            )
+
+    try:
+        chat_completion = scheduler.call(
+            attempt,
+            estimate_request_tokens(messages),
+            route_priority(route),
+            used_tokens=lambda completion: completion.usage.total_tokens if completion.usage else None
+        )
+    except Exception as e:
+        upstream_errors.inc(route=route, model=model, error=type(e).__name__)
+        raise
+
+    record_usage(route, model, chat_completion.usage)
+    content = chat_completion.choices[0].message.content
+    llm_cache.set(key, content)
+    return content
 
 task = '''
     You are a helpful educational assistant. You will be provided with a section of a textbook and an essay prompt,
@@ -52,380 +249,966 @@ assert_task = '''
 
 @app.route('/')
 def index():
-    clear_tables()
+    # Every page load starts a new document; old sessions expire in the background
+    start_session()
     return render_template('rewrite.html')  # Render the HTML file
 
+# Most source-text tokens sent in one prompt; longer sources are reduced to
+# the passages most relevant to the essay prompt or the essay's claims
+SOURCE_TOKEN_BUDGET = int(os.getenv("SOURCE_TOKEN_BUDGET", "3000"))
+
+# Structured output format for generated essays
+rewrite_response_format = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "essay_response",
+        "schema": {
+            "type": "object",
+            "properties": {
+                "final_answer": {"type": "string"}
+            },
+            "required": ["final_answer"],
+            "additionalProperties": False
+        },
+        "strict": True
+    }
+}
+
+rewrite_system_prompt = dedent(task)
+
+def rewrite_messages(source_text, essay_prompt):
+    """Prepare messages for the ChatGPT API."""
+    # Long textbook sections are cut down to the passages relevant to the prompt
+    source_text = select_passages(source_text, [essay_prompt or ""], SOURCE_TOKEN_BUDGET)
+    return [
+        {"role": "system", "content": rewrite_system_prompt},
+        {"role": "user", "content": f"Textbook: {source_text}"},
+        {"role": "user", "content": f"Assignment: {essay_prompt}"}
+    ]
+
 @app.route('/rewrite', methods=['POST'])
 def rewrite():
     data = request.json
     source_text = data.get('source_text')
     essay_prompt = data.get('essay_prompt')
+    use_cache = not data.get('no_cache')
+    session_id = get_session_id()
 
-    # Prepare messages for ChatGPT API
-    messages = [
-        {"role": "system", "content": dedent(task)},
-        {"role": "user", "content": dedent(f"Textbook: {source_text}")},
-        {"role": "user", "content": dedent(f"Assignment: {essay_prompt}")}
-    ]
+    messages = rewrite_messages(source_text, essay_prompt)
 
     # Call the OpenAI chat completion API
     try:
-        chat_completion = client.chat.completions.create(
+        content = create_completion(
             messages=messages,
             model="gpt-4o-mini",  # Change this to the appropriate model as needed
-            response_format={
-                "type": "json_schema",
-                "json_schema": {
-                    "name": "essay_response",
-                    "schema": {
-                        "type": "object",
-                        "properties": {
-                            "final_answer": {"type": "string"}
-                        },
-                        "required": ["final_answer"],
-                        "additionalProperties": False
-                    },
-                    "strict": True
-                }
-            }
+            response_format=rewrite_response_format,
+            use_cache=use_cache,
+            route="rewrite"
         )
 
         # Parse the result
-        result = json.loads(chat_completion.choices[0].message.content)
+        result = parse_completion(content, "rewrite")
         rewritten_text = result.get('final_answer', "No answer provided.")
+        speculate(session_id, result.get('final_answer'), source_text)
 
     except Exception as e:
         rewritten_text = "An unexpected error occurred: " + str(e)
 
     return jsonify({"response": rewritten_text})
 
+@app.route('/rewrite-stream', methods=['POST'])
+def rewrite_stream():
+    """
+    Stream the generated essay as Server-Sent Events.
 
-####### SIMPLIFY #######
-
-@app.route('/simplify', methods=['POST'])
-def simplify():
+    Sends a "token" event with each new piece of final_answer text, then a
+    "done" event carrying token usage (or an "error" event).
+    """
     data = request.json
-    essay = data.get('essay')
-
-    # Prepare messages for evaluation
-    messages = [
-        {"role": "system", "content": dedent(simplify_task)},
-        {"role": "user", "content": dedent('''Provide:
-                                            - A list where each entry is an identified word that meets the criteria for being overly academic or complex (as simplify_context).
-                                            - A list where each entry provides an explanation of why the identified word is overly academic or complex and presents a significant barrier to comprehension (as simplify_reasoning).
-                                            - A list where each entry suggests a simpler, equally precise alternative or improvement, ensuring the meaning and tone remain appropriate for the audience (as simplify_suggestion).
-                                           ''')},
-        {"role": "user", "content": dedent(f"Essay: {essay}")}
-    ]
+    source_text = data.get('source_text')
+    essay_prompt = data.get('essay_prompt')
+    use_cache = not data.get('no_cache')
+
+    messages = rewrite_messages(source_text, essay_prompt)
+    model = "gpt-4o-mini"
+    session_id = get_session_id()
+
+    def generate():
+        key = cache_key(model, messages, rewrite_response_format)
+        content = llm_cache.get(key) if use_cache else None
+        if content is not None:
+            final_answer = loads(content).get('final_answer', "")
+            yield sse_event("token", {"text": final_answer})
+            speculate(session_id, final_answer, source_text)
+            yield sse_event("done", {"usage": None, "cached": True})
+            return
+
+        try:
+            start = time.perf_counter()
+            first_token = None
+            # Retries cover opening the stream; once tokens flow the call
+            # can no longer be retried transparently. The slot is held until
+            # the stream ends, then released with the usage it reported.
+            tokens = estimate_request_tokens(messages)
+            stream = scheduler.call(
+                partial(
+                    client.chat.completions.create,
+                    messages=messages,
+                    model=model,
+                    response_format=rewrite_response_format,
+                    stream=True,
+                    stream_options={"include_usage": True}
+                ),
+                tokens,
+                INTERACTIVE,
+                hold=True
+            )
 
-    # Call the OpenAI chat completion API for evaluation
-    try:
-        chat_completion = client.chat.completions.create(
-            messages=messages,
-            model="gpt-4o-mini",
-            response_format={
-                "type": "json_schema",
-                "json_schema": {
-                    "name": "evaluation_response",
-                    "schema": {
-                        "type": "object",
-                        "properties": {
-                            "simplify_context": {"type": "array", "items": {"type": "string"}},
-                            "simplify_reasoning": {"type": "array", "items": {"type": "string"}},
-                            "simplify_suggestion": {"type": "array", "items": {"type": "string"}},
-
-                        },
-                        "required": ["simplify_context", "simplify_reasoning", "simplify_suggestion"],
-                        "additionalProperties": False
-                    },
-                    "strict": True
-                }
-            }
+            extractor = JSONStringFieldExtractor('final_answer')
+            chunks = []
+            sent = []
+            usage = None
+            chunk_usage = None
+            try:
+                for chunk in stream:
+                    if chunk.usage is not None:
+                        chunk_usage = chunk.usage
+                        usage = chunk.usage.model_dump()
+                    if not chunk.choices or not chunk.choices[0].delta.content:
+                        continue
+                    if first_token is None:
+                        first_token = time.perf_counter() - start
+                        upstream_first_token.observe(first_token, route="rewrite", model=model)
+                    chunks.append(chunk.choices[0].delta.content)
+                    text = extractor.feed(chunks[-1])
+                    if text:
+                        sent.append(text)
+                        yield sse_event("token", {"text": text})
+            finally:
+                # Also runs when the client disconnects mid-stream
+                stream.close()
+                scheduler.release(tokens, chunk_usage.total_tokens if chunk_usage else None)
+
+            upstream_latency.observe(time.perf_counter() - start, route="rewrite", model=model)
+            record_usage("rewrite", model, chunk_usage)
+
+            # Flush anything the extractor held back, then cache the full response
+            content = ''.join(chunks)
+            final_answer = parse_completion(content, "rewrite").get('final_answer', "")
+            remainder = final_answer[len(''.join(sent)):]
+            if remainder:
+                yield sse_event("token", {"text": remainder})
+            llm_cache.set(key, content)
+            speculate(session_id, final_answer, source_text)
+
+            yield sse_event("done", {"usage": usage, "cached": False})
+
+        except Exception as e:
+            upstream_errors.inc(route="rewrite", model=model, error=type(e).__name__)
+            yield sse_event("error", {"error": "An unexpected error occurred: " + str(e)})
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+####### ANALYZERS #######
+
+ANALYZER_MODEL = "gpt-4o-mini"
+
+# Every analyzer request opens with this and the essay, and only then gives
+# the analyzer's own instructions, so all the calls for one essay share a
+# long identical prefix that the provider's prompt cache can reuse.
+ANALYZER_PREAMBLE = (
+    "You are an editor reviewing a student's essay. The essay comes first, "
+    "followed by the specific task and the lists you must provide."
+)
+
+class Analyzer:
+    """
+    One essay analysis, declared as data.
+
+    `task` is the analyzer's system prompt; `context`, `reasoning` and
+    `suggestion` describe the three lists it returns. Prompts and the
+    response schema are built once, here, rather than on every request.
+    """
+
+    # Only analyzers that don't send the whole essay to the model set another mode
+    mode = "llm"
+
+    def __init__(self, name, task, context, reasoning, suggestion, uses_source=False):
+        self.name = name
+        self.uses_source = uses_source
+        self.fields = [f"{name}_context", f"{name}_reasoning", f"{name}_suggestion"]
+        provide = "\n".join(
+            f"- {description} (as {field})."
+            for description, field in zip((context, reasoning, suggestion), self.fields)
         )
-
-        # Parse the result
-        result = json.loads(chat_completion.choices[0].message.content)
-        simplify_context = result.get('simplify_context', [])
-        simplify_reasoning = result.get('simplify_context', [])
-        simplify_suggestion = result.get('simplify_suggestion', [])
-
-    except Exception as e:
-        print(f"Error: {e}")
-        simplify_context = []
-        simplify_reasoning = []
-        simplify_suggestion = []
-
-    return jsonify({
-        "simplify_context": simplify_context,
-        "simplify_reasoning": simplify_reasoning,
-        "simplify_suggestion": simplify_suggestion,
-
-        })
-
-
-####### EXEMPLIFY #######
-
-@app.route('/exemplify', methods=['POST'])
-def exemplify():
-    data = request.json
-    essay = data.get('essay')
-
-    # Prepare messages for evaluation
-    messages = [
-        {"role": "system", "content": dedent(exemplify_task)},
-        {"role": "user", "content": dedent('''Provide:
-                                            - A list where each entry includes the four words closest to the identified spot that clearly indicate where an example would enhance the content (as exemplify_context).
-                                            - A list where each entry provides a clear reasoning for why the identified spot critically lacks an example, emphasizing how it impacts clarity, engagement, or persuasiveness (as exemplify_reasoning).
-                                            - A list where each entry suggests a specific type of example or approach the user could take to improve the spot, ensuring the suggestion aligns with the context and enhances relatability or evidence (as exemplify_suggestion).
-                                           ''')},
-        {"role": "user", "content": dedent(f"Essay: {essay}")}
-    ]
-
-    # Call the OpenAI chat completion API for evaluation
-    try:
-        chat_completion = client.chat.completions.create(
-            messages=messages,
-            model="gpt-4o-mini",
-            response_format={
-                "type": "json_schema",
-                "json_schema": {
-                    "name": "evaluation_response",
-                    "schema": {
-                        "type": "object",
-                        "properties": {
-                            "exemplify_context": {"type": "array", "items": {"type": "string"}},
-                            "exemplify_reasoning": {"type": "array", "items": {"type": "string"}},
-                            "exemplify_suggestion": {"type": "array", "items": {"type": "string"}}
-                        },
-                        "required": ["exemplify_context", "exemplify_reasoning", "exemplify_suggestion"],
-                        "additionalProperties": False
-                    },
-                    "strict": True
-                }
+        self.instructions = [
+            {"role": "system", "content": dedent(task).strip()},
+            {"role": "user", "content": "Provide:\n" + provide}
+        ]
+        self.response_format = {
+            "type": "json_schema",
+            "json_schema": {
+                "name": "evaluation_response",
+                "schema": {
+                    "type": "object",
+                    "properties": {field: {"type": "array", "items": {"type": "string"}} for field in self.fields},
+                    "required": self.fields,
+                    "additionalProperties": False
+                },
+                "strict": True
             }
-        )
-
-        # Parse the result
-        result = json.loads(chat_completion.choices[0].message.content)
-        exemplify_context = result.get('exemplify_context', [])
-        exemplify_reasoning = result.get('exemplify_reasoning', [])
-        exemplify_suggestion = result.get('exemplify_suggestion', [])
-
-    except Exception as e:
-        print(f"Error: {e}")
-        exemplify_context = []
-        exemplify_reasoning = []
-        exemplify_suggestion = []
-
-
-
-    return jsonify({
-        "exemplify_context": exemplify_context,
-        "exemplify_reasoning": exemplify_reasoning,
-        "exemplify_suggestion": exemplify_suggestion
-        })
-
-
-####### FACTCHECK #######
-
-@app.route('/factcheck', methods=['POST'])
-def factcheck():
+        }
+        # Changes whenever the prompt, schema or model do, so findings cached
+        # per paragraph under older ones are not served again
+        self.digest = hashlib.sha256(
+            dumps([ANALYZER_MODEL, ANALYZER_PREAMBLE, self.instructions, self.response_format])
+        ).hexdigest()
+
+    def messages(self, essay, source_text=None):
+        messages = [
+            {"role": "system", "content": ANALYZER_PREAMBLE},
+            {"role": "user", "content": f"Essay: {essay}"}
+        ]
+        if self.uses_source:
+            # Only the passages relevant to the essay's sentences are sent
+            source = select_passages(source_text, split_sentences(essay or ""), SOURCE_TOKEN_BUDGET)
+            messages.append({"role": "user", "content": f"Source Text: {source}"})
+        return messages + self.instructions
+
+    def run(self, essay, source_text=None, use_cache=True):
+        """Run the analysis on an essay and return its findings."""
+        return self.complete(self.messages(essay, source_text), use_cache)
+
+    def complete(self, messages, use_cache=True):
+        """Send prepared messages to the model and return the findings."""
+        error = None
+        try:
+            content = create_completion(
+                messages=messages,
+                model=ANALYZER_MODEL,
+                response_format=self.response_format,
+                use_cache=use_cache,
+                route=self.name
+            )
+            result = parse_completion(content, self.name)
+            findings = {field: result.get(field, []) for field in self.fields}
+
+        except Exception as e:
+            print(f"Error: {e}")
+            error = str(e)
+            findings = {field: [] for field in self.fields}
+
+        findings["error"] = error
+        return findings
+
+class SimplifyAnalyzer(Analyzer):
+    """
+    The simplify analysis, screened locally first.
+
+    Every word is scored against a bundled word-frequency list and syllable
+    and suffix heuristics (see lexicon.py). Clearly complex words are
+    flagged here, common ones are dropped, and only the ambiguous rest goes
+    to the model, as a candidate list with the sentences using them. In
+    "offline" mode nothing goes upstream; in "llm" mode the whole essay
+    does, as before. If the model call fails, the local findings are
+    still returned along with the error.
+    """
+
+    def __init__(self, *args, mode="hybrid", **kwargs):
+        super().__init__(*args, **kwargs)
+        self.mode = mode
+        if mode != "llm":
+            # Read the word list at startup rather than on the first request
+            load_lexicon()
+
+    def messages(self, essay, source_text=None):
+        """The upstream request for an essay, or None if the screen settles every word."""
+        if self.mode == "llm":
+            return super().messages(essay, source_text)
+        _, ambiguous = screen_words(essay or "")
+        if self.mode == "offline" or not ambiguous:
+            return None
+        return self.candidate_messages(ambiguous)
+
+    def candidate_messages(self, ambiguous):
+        sentences = list(dict.fromkeys(sentence for _, sentence in ambiguous))
+        return [
+            {"role": "system", "content": ANALYZER_PREAMBLE},
+            {"role": "user", "content": "Essay excerpts:\n" + "\n".join(sentences)},
+            {"role": "user", "content": (
+                "Consider only these candidate words and list only those that meet the criteria: "
+                + ", ".join(word for word, _ in ambiguous)
+            )},
+        ] + self.instructions
+
+    def run(self, essay, source_text=None, use_cache=True):
+        if self.mode == "llm":
+            return super().run(essay, source_text, use_cache)
+
+        flagged, ambiguous = screen_words(essay or "")
+        context_field, reasoning_field, suggestion_field = self.fields
+        findings = {
+            context_field: [word for word, _, _ in flagged],
+            reasoning_field: [
+                f'"{word}" is rare in everyday English and has {syllables} syllables, '
+                "so many readers will have to stop and work it out."
+                for word, _, syllables in flagged
+            ],
+            suggestion_field: [
+                f'Use a more common word for "{word}", or explain it briefly the first time it appears.'
+                for word, _, _ in flagged
+            ],
+            "error": None,
+        }
+        if self.mode == "offline" or not ambiguous:
+            return findings
+
+        result = self.complete(self.candidate_messages(ambiguous), use_cache)
+        for field in self.fields:
+            findings[field].extend(result[field])
+        findings["error"] = result["error"]
+        return findings
+
+# "hybrid" screens words locally and asks the model about the unclear ones,
+# "offline" never calls the model, "llm" sends the whole essay
+SIMPLIFY_MODE = os.getenv("SIMPLIFY_MODE", "hybrid")
+
+ANALYZERS = {analyzer.name: analyzer for analyzer in [
+    SimplifyAnalyzer(
+        "simplify", simplify_task,
+        context="A list where each entry is an identified word that meets the criteria for being overly academic or complex",
+        reasoning="A list where each entry provides an explanation of why the identified word is overly academic or complex and presents a significant barrier to comprehension",
+        suggestion="A list where each entry suggests a simpler, equally precise alternative or improvement, ensuring the meaning and tone remain appropriate for the audience",
+        mode=SIMPLIFY_MODE
+    ),
+    Analyzer(
+        "exemplify", exemplify_task,
+        context="A list where each entry includes the four words closest to the identified spot that clearly indicate where an example would enhance the content",
+        reasoning="A list where each entry provides a clear reasoning for why the identified spot critically lacks an example, emphasizing how it impacts clarity, engagement, or persuasiveness",
+        suggestion="A list where each entry suggests a specific type of example or approach the user could take to improve the spot, ensuring the suggestion aligns with the context and enhances relatability or evidence"
+    ),
+    Analyzer(
+        "factcheck", factcheck_task,
+        context="A list where each entry includes the four words closest to the identified spot that clearly indicate the statement or claim requiring fact-checking",
+        reasoning="A list where each entry provides an explanation of why the identified spot was chosen, focusing on significant claims that appear unsupported, contradictory, or potentially misleading",
+        suggestion="A list where each entry suggests a specific improvement, such as verifying the claim with credible sources, rephrasing for accuracy, or removing unsupported statements",
+        uses_source=True
+    ),
+    Analyzer(
+        "assert", assert_task,
+        context="A list where each entry includes the four words closest to the identified spot that clearly indicate where a stronger or more original stance is needed",
+        reasoning="A list where each entry provides an explanation of why the identified spot was chosen, focusing on areas that appear overly neutral, lack conviction, or fail to present a distinct perspective",
+        suggestion="A list where each entry suggests a specific way the user could improve the spot, such as by taking a definitive stance, adding stronger reasoning, or presenting a unique perspective to enhance engagement and persuasiveness"
+    ),
+    Analyzer(
+        "clarify", clarify_task,
+        context="A list where each entry includes the four words closest to the identified spot that highlight where deeper exploration or clarification is needed",
+        reasoning="A list where each entry provides an explanation of why the identified spot was chosen, focusing on areas where key implications, assumptions, or consequences are notably unexplored or vague",
+        suggestion="A list where each entry suggests a specific way the user could enhance the spot, such as expanding on implications, questioning assumptions, or exploring ethical, moral, social, or practical consequences"
+    ),
+]}
+
+def analyzer_view(analyzer):
+    """Build the POST route that runs one analyzer and stores its edits."""
+    def view():
+        data = request.json
+        essay = data.get('essay')
+        result, edits = analyze_document(analyzer, essay, data.get('source_text'), use_cache=not data.get('no_cache'))
+        if edits:
+            store_edits(get_session_id(), edits)
+        return jsonify(result)
+    return view
+
+# /simplify, /exemplify, /factcheck, /assert and /clarify
+for analyzer in ANALYZERS.values():
+    app.add_url_rule(f'/{analyzer.name}', endpoint=analyzer.name, view_func=analyzer_view(analyzer), methods=['POST'])
+
+
+####### EVALUATE #######
+# Shared pool for the /evaluate fan-out. Bounded so a burst of evaluations
+# can't open an unbounded number of upstream connections.
+evaluate_executor = ThreadPoolExecutor(max_workers=int(os.getenv("EVALUATE_WORKERS", "10")))
+
+# Separates the changed paragraphs sent upstream in one request
+PARAGRAPH_SEPARATOR = "\n\n"
+
+# Text longer than this many words is analyzed in parallel windows of about
+# WINDOW_WORDS words, so a long essay takes about as long as a short one
+LONG_ESSAY_WORDS = int(os.getenv("LONG_ESSAY_WORDS", "1500"))
+WINDOW_WORDS = int(os.getenv("WINDOW_WORDS", "800"))
+WINDOW_OVERLAP_WORDS = int(os.getenv("WINDOW_OVERLAP_WORDS", "60"))
+
+@app.route('/evaluate', methods=['POST'])
+def evaluate():
+    """
+    Run every analyzer concurrently, store their findings and return them.
+
+    If a speculative evaluation of this essay is still running for the
+    session, it is waited for and its findings are reused; one of an essay
+    the user has edited since is cancelled instead (see speculate()).
+    """
     data = request.json
     essay = data.get('essay')
     source_text = data.get('source_text')
+    use_cache = not data.get('no_cache')
+    session_id = get_session_id()
 
-    # Prepare messages for evaluation
-    messages = [
-        {"role": "system", "content": dedent(factcheck_task)},
-        {"role": "user", "content": dedent('''Provide:
-                                            - A list where each entry includes the four words closest to the identified spot that clearly indicate the statement or claim requiring fact-checking (as factcheck_context).
-                                            - A list where each entry provides an explanation of why the identified spot was chosen, focusing on significant claims that appear unsupported, contradictory, or potentially misleading (as factcheck_reasoning).
-                                            - A list where each entry suggests a specific improvement, such as verifying the claim with credible sources, rephrasing for accuracy, or removing unsupported statements (as factcheck_suggestion).
-                                           ''')},
-        {"role": "user", "content": dedent(f"Essay: {essay}")},
-        {"role": "user", "content": dedent(f"Source Text: {source_text}")}
-    ]
+    if not essay:
+        return jsonify({"error": "Missing essay"}), 400
 
-    # Call the OpenAI chat completion API for evaluation
     try:
-        chat_completion = client.chat.completions.create(
-            messages=messages,
-            model="gpt-4o-mini",
-            response_format={
-                "type": "json_schema",
-                "json_schema": {
-                    "name": "evaluation_response",
-                    "schema": {
-                        "type": "object",
-                        "properties": {
-                            "factcheck_context": {"type": "array", "items": {"type": "string"}},
-                            "factcheck_reasoning": {"type": "array", "items": {"type": "string"}},
-                            "factcheck_suggestion": {"type": "array", "items": {"type": "string"}},
-                        },
-                        "required": ["factcheck_context", "factcheck_reasoning", "factcheck_suggestion"],
-                        "additionalProperties": False
-                    },
-                    "strict": True
-                }
-            }
-        )
-
-        # Parse the result
-        result = json.loads(chat_completion.choices[0].message.content)
-        factcheck_context = result.get('factcheck_context', [])
-        factcheck_reasoning = result.get('factcheck_reasoning', [])
-        factcheck_suggestion = result.get('factcheck_suggestion', [])
+        if use_cache:
+            attach_speculation(session_id, essay)
+        edits, analyzed, reused, errors = evaluate_essay(essay, source_text, use_cache)
+        replace_edits(session_id, edits)
+        edits = fetch_edits(session_id)
 
     except Exception as e:
-        print(f"Error: {e}")
-        factcheck_context = []
-        factcheck_reasoning = []
-        factcheck_suggestion = []
-
+        return jsonify({"error": str(e)}), 500
 
     return jsonify({
-        "factcheck_context": factcheck_context,
-        "factcheck_reasoning": factcheck_reasoning,
-        "factcheck_suggestion": factcheck_suggestion,
-        })
-
-
-####### CLARIFY #######
-
-@app.route('/clarify', methods=['POST'])
-def clarify():
-    data = request.json
-    essay = data.get('essay')
-
-    # Prepare messages for evaluation
-    messages = [
-        {"role": "system", "content": dedent(factcheck_task)},
-        {"role": "user", "content": dedent('''Provide:
-                                            - A list where each entry includes the four words closest to the identified spot that highlight where deeper exploration or clarification is needed (as clarify_context).
-                                            - A list where each entry provides an explanation of why the identified spot was chosen, focusing on areas where key implications, assumptions, or consequences are notably unexplored or vague (as clarify_reasoning).
-                                            - A list where each entry suggests a specific way the user could enhance the spot, such as expanding on implications, questioning assumptions, or exploring ethical, moral, social, or practical consequences (as clarify_suggestion).
-                                           ''')},
-        {"role": "user", "content": dedent(f"Essay: {essay}")}
+        "edits": edits,
+        # The tracked draft this evaluation saw, for /get-document?version=
+        "document_version": seal_document(session_id),
+        "analyzed_paragraphs": analyzed,
+        "reused_paragraphs": reused,
+        "errors": errors,
+    }), 200
+
+def evaluate_essay(essay, source_text=None, use_cache=True, cancelled=None):
+    """
+    Run every analyzer over an essay and return (edits, analyzed paragraphs,
+    reused paragraphs, errors by analyzer).
+
+    Findings are cached per (analyzer, paragraph), so after a small edit only
+    the new or changed paragraphs are sent upstream. Findings for unchanged
+    paragraphs are reused and moved to the paragraph's new position. When
+    the changed paragraphs are long they are sent in several requests of
+    whole paragraphs that run in parallel. Once the `cancelled` event is
+    set, analyses that haven't started yet are skipped.
+    """
+    def analyze(analyzer, text):
+        if cancelled is not None and cancelled.is_set():
+            return None
+        return analyzer.run(text, source_text, use_cache=use_cache)
+
+    paragraphs = split_paragraphs(essay)
+    keys = {
+        edit_type: [paragraph_key(edit_type, essay[start:end], source_text) for start, end in paragraphs]
+        for edit_type in ANALYZERS
+    }
+    known = load_paragraph_findings([key for edit_keys in keys.values() for key in edit_keys]) if use_cache else {}
+
+    # Submit every analyzer at once so latency is that of the slowest one,
+    # each with only the paragraphs it hasn't seen before
+    futures = {}
+    for edit_type, analyzer in ANALYZERS.items():
+        changed = [i for i, key in enumerate(keys[edit_type]) if key not in known]
+        texts = [essay[paragraphs[i][0]:paragraphs[i][1]] for i in changed]
+        futures[edit_type] = [
+            (group, group_texts, evaluate_executor.submit(analyze, analyzer, PARAGRAPH_SEPARATOR.join(group_texts)))
+            for group, group_texts in group_paragraphs(changed, texts)
+        ]
+
+    new_findings = {}
+    partial_findings = {}
+    errors = {}
+    for edit_type, groups in futures.items():
+        for changed, texts, future in groups:
+            result = future.result()
+            if result is None:
+                continue
+            # Findings from a failed call (such as simplify's local ones) are
+            # shown but not cached, so the next evaluation retries them
+            target = new_findings
+            if result.get("error"):
+                errors[edit_type] = result["error"]
+                target = partial_findings
+            for i, findings in zip(changed, split_findings(edit_type, result, texts)):
+                target[keys[edit_type][i]] = findings
+
+    # Rebase every paragraph's findings onto its position in this essay
+    edits = []
+    for edit_type, edit_keys in keys.items():
+        for (start, _), key in zip(paragraphs, edit_keys):
+            for finding in known.get(key) or new_findings.get(key) or partial_findings.get(key) or []:
+                edits.append({
+                    "type": edit_type,
+                    "phrase": finding["phrase"],
+                    "suggestion": finding["suggestion"],
+                    "reasoning": finding["reasoning"],
+                    "startIndex": start + finding["start"],
+                    "endIndex": start + finding["end"],
+                    "completed": False,
+                })
+
+    save_paragraph_findings(new_findings)
+    analyzed = sum(len(changed) for groups in futures.values() for changed, _, _ in groups)
+    return edits, analyzed, len(paragraphs) * len(ANALYZERS) - analyzed, errors
+
+def group_paragraphs(indices, texts):
+    """
+    Split paragraphs into the groups sent upstream together: all of them if
+    they total at most LONG_ESSAY_WORDS words, otherwise runs of about
+    WINDOW_WORDS words (a longer paragraph goes alone). Yields
+    (indices, texts) per group.
+    """
+    counts = [len(text.split()) for text in texts]
+    if sum(counts) <= LONG_ESSAY_WORDS:
+        if texts:
+            yield indices, texts
+        return
+
+    first = 0
+    words = 0
+    for position, count in enumerate(counts):
+        if position > first and words + count > WINDOW_WORDS:
+            yield indices[first:position], texts[first:position]
+            first, words = position, 0
+        words += count
+    yield indices[first:], texts[first:]
+
+def analyze_document(analyzer, essay, source_text=None, use_cache=True):
+    """
+    Run one analyzer over an essay and return (result, edits located in the essay).
+
+    Essays over LONG_ESSAY_WORDS words are split into overlapping windows
+    that are analyzed in parallel. Each window's findings are rebased onto
+    the whole essay, and a finding in an overlap that the previous window
+    already reported is dropped. The result then lists the merged findings
+    in essay order.
+    """
+    if not essay or len(essay.split()) <= LONG_ESSAY_WORDS:
+        result = analyzer.run(essay, source_text, use_cache=use_cache)
+        return result, collect_edits(essay, {analyzer.name: result}) if essay else []
+
+    windows = chunk_passages(essay, passage_words=WINDOW_WORDS, overlap=WINDOW_OVERLAP_WORDS)
+    futures = [
+        evaluate_executor.submit(analyzer.run, essay[start:end], source_text, use_cache=use_cache)
+        for start, end in windows
     ]
 
-    # Call the OpenAI chat completion API for evaluation
-    try:
-        chat_completion = client.chat.completions.create(
-            messages=messages,
-            model="gpt-4o-mini",
-            response_format={
-                "type": "json_schema",
-                "json_schema": {
-                    "name": "evaluation_response",
-                    "schema": {
-                        "type": "object",
-                        "properties": {
-                            "clarify_context": {"type": "array", "items": {"type": "string"}},
-                            "clarify_reasoning": {"type": "array", "items": {"type": "string"}},
-                            "clarify_suggestion": {"type": "array", "items": {"type": "string"}},
-                        },
-                        "required": ["clarify_context", "clarify_reasoning", "clarify_suggestion"],
-                        "additionalProperties": False
-                    },
-                    "strict": True
-                }
-            }
+    edits = []
+    errors = []
+    previous = []
+    previous_end = 0
+    for (start, end), future in zip(windows, futures):
+        result = future.result()
+        if result.get("error"):
+            # A failed window can still carry local findings (simplify's word list)
+            errors.append(result["error"])
+
+        window_edits = []
+        for edit in collect_edits(essay[start:end], {analyzer.name: result}):
+            edit["startIndex"] += start
+            edit["endIndex"] += start
+            duplicate = edit["startIndex"] < previous_end and any(
+                edit["startIndex"] < other["endIndex"] and other["startIndex"] < edit["endIndex"]
+                for other in previous
+            )
+            if not duplicate:
+                window_edits.append(edit)
+        edits.extend(window_edits)
+        previous = window_edits
+        previous_end = end
+
+    edits.sort(key=lambda edit: edit["startIndex"])
+    context_field, reasoning_field, suggestion_field = analyzer.fields
+    result = {
+        context_field: [edit["phrase"] for edit in edits],
+        reasoning_field: [edit["reasoning"] for edit in edits],
+        suggestion_field: [edit["suggestion"] for edit in edits],
+        "error": f"{len(errors)} of {len(windows)} windows failed: {errors[0]}" if errors else None,
+    }
+    return result, edits
+
+def paragraph_key(edit_type, paragraph, source_text):
+    """
+    Key an analyzer's findings for one paragraph (and the source, for
+    analyzers that read it) under its current prompt, schema and model.
+    """
+    analyzer = ANALYZERS[edit_type]
+    parts = [edit_type, analyzer.digest, paragraph]
+    if analyzer.uses_source:
+        parts.append(source_text or "")
+    if analyzer.mode != "llm":
+        parts.append(analyzer.mode)
+    return hashlib.sha256('\0'.join(parts).encode('utf-8')).hexdigest()
+
+def split_findings(edit_type, result, texts):
+    """
+    Locate one analyzer's findings in the joined paragraphs it was sent and
+    return them per paragraph, with offsets relative to that paragraph.
+    """
+    starts = []
+    position = 0
+    for text in texts:
+        starts.append(position)
+        position += len(text) + len(PARAGRAPH_SEPARATOR)
+
+    findings = [[] for _ in texts]
+    for edit in collect_edits(PARAGRAPH_SEPARATOR.join(texts), {edit_type: result}):
+        i = bisect_right(starts, edit["startIndex"]) - 1
+        findings[i].append({
+            "phrase": edit["phrase"],
+            "suggestion": edit["suggestion"],
+            "reasoning": edit["reasoning"],
+            "start": edit["startIndex"] - starts[i],
+            # A phrase can't run past the end of its paragraph
+            "end": min(edit["endIndex"] - starts[i], len(texts[i])),
+        })
+    return findings
+
+def load_paragraph_findings(keys):
+    """
+    Return {key: findings} for every key with cached findings younger than
+    the LLM cache TTL, which is also when the periodic prune drops them.
+    """
+    found = {}
+    cutoff = time.time() - llm_cache.ttl
+    # Stay well under SQLite's limit on bound parameters
+    for i in range(0, len(keys), 500):
+        batch = keys[i:i + 500]
+        rows = db.fetchall(
+            f"SELECT key, findings FROM paragraph_findings WHERE key IN ({', '.join('?' * len(batch))}) AND created_at >= ?",
+            batch + [cutoff]
         )
-
-        # Parse the result
-        result = json.loads(chat_completion.choices[0].message.content)
-        clarify_context = result.get('clarify_context', [])
-        clarify_reasoning = result.get('clarify_reasoning', [])
-        clarify_suggestion = result.get('clarify_suggestion', [])
-
-    except Exception as e:
-        print(f"Error: {e}")
-        clarify_context = []
-        clarify_reasoning = []
-        clarify_suggestion = []
-
-
-    return jsonify({
-        "clarify_context": clarify_context,
-        "clarify_reasoning": clarify_reasoning,
-        "clarify_suggestion": clarify_suggestion,
-
+        found.update((row['key'], loads(row['findings'])) for row in rows)
+    return found
+
+def save_paragraph_findings(findings):
+    """Cache findings for newly analyzed paragraphs."""
+    now = time.time()
+    db.executemany(
+        'INSERT OR REPLACE INTO paragraph_findings (key, findings, created_at) VALUES (?, ?, ?)',
+        [(key, dumps(value).decode('utf-8'), now) for key, value in findings.items()]
+    )
+
+def collect_edits(essay, results):
+    """Turn analyzer results into edit rows located in the original essay."""
+    findings = []
+    for edit_type, result in results.items():
+        suggestions = result.get(f"{edit_type}_suggestion", [])
+        reasonings = result.get(f"{edit_type}_reasoning", [])
+        for index, phrase in enumerate(result.get(f"{edit_type}_context", [])):
+            suggestion = suggestions[index] if index < len(suggestions) else ""
+            reasoning = reasonings[index] if index < len(reasonings) else ""
+            findings.append((edit_type, phrase, suggestion, reasoning))
+
+    # Resolve every phrase from this analysis pass in a single scan
+    spans = resolve_spans(essay, [phrase for _, phrase, _, _ in findings])
+
+    edits = []
+    for (edit_type, phrase, suggestion, reasoning), span in zip(findings, spans):
+        if span is None:
+            unresolved_phrases.inc(route=edit_type)
+            continue
+
+        edits.append({
+            "type": edit_type,
+            "phrase": phrase,
+            "suggestion": suggestion or f"No suggestion for this {edit_type} edit.",
+            "reasoning": reasoning or f"No reasoning for this {edit_type} edit.",
+            "startIndex": span[0],
+            "endIndex": span[1],
+            "completed": False,
         })
 
-
-####### ASSERT #######
-
-@app.route('/assert', methods=['POST'])
-def assertify():
-    data = request.json
-    essay = data.get('essay')
-
-    # Prepare messages for evaluation
-    messages = [
-        {"role": "system", "content": dedent(assert_task)},
-        {"role": "user", "content": dedent('''Provide:
-                                            - A list where each entry includes the four words closest to the identified spot that clearly indicate where a stronger or more original stance is needed (as assert_context).
-                                            - A list where each entry provides an explanation of why the identified spot was chosen, focusing on areas that appear overly neutral, lack conviction, or fail to present a distinct perspective (as assert_reasoning).
-                                            - A list where each entry suggests a specific way the user could improve the spot, such as by taking a definitive stance, adding stronger reasoning, or presenting a unique perspective to enhance engagement and persuasiveness (as assert_suggestion).
-                                           ''')},
-        {"role": "user", "content": dedent(f"Essay: {essay}")}
-    ]
-
-    # Call the OpenAI chat completion API for evaluation
+    return edits
+
+
+####### SPECULATIVE EVALUATION #######
+# Opt-in: evaluate every essay /rewrite writes in the background, so its
+# findings are already cached when the user clicks Evaluate
+SPECULATIVE_EVALUATION = os.getenv("SPECULATIVE_EVALUATION", "") == "1"
+# Speculative evaluations running at once; essays arriving while all are busy are skipped
+SPECULATIVE_WORKERS = int(os.getenv("SPECULATIVE_WORKERS", "2"))
+# Estimated upstream tokens per minute speculation may spend; essays over budget are skipped
+SPECULATIVE_TPM = int(os.getenv("SPECULATIVE_TPM", "50000"))
+
+speculative_executor = ThreadPoolExecutor(max_workers=SPECULATIVE_WORKERS)
+speculative_budget = TokenBucket(SPECULATIVE_TPM)
+speculation_lock = threading.Lock()
+speculations_pending = 0
+
+# Latest speculation per session, and the essays already speculated on
+speculations = LRUCache(max_entries=1024, ttl=60 * 60)
+speculated_essays = LRUCache(max_entries=1024, ttl=60 * 60)
+
+def speculate(session_id, essay, source_text=None):
+    """Queue a background evaluation of a freshly written essay, within the worker and token caps."""
+    global speculations_pending
+    if not SPECULATIVE_EVALUATION or not essay:
+        return
+
+    key = hashlib.sha256('\0'.join([essay, source_text or ""]).encode('utf-8')).hexdigest()
+    current = speculations.get(session_id)
+    if current is None or current["key"] != key:
+        # A new essay replaces whatever the session was speculating on; the
+        # same one again (a cached rewrite) leaves it running
+        cancel_speculation(session_id)
+    cost = (estimate_tokens(essay) + COMPLETION_TOKEN_ALLOWANCE) * len(ANALYZERS)
+
+    with speculation_lock:
+        if speculated_essays.get(key):
+            speculative_evaluations.inc(result='duplicate')
+            return
+        if speculations_pending >= SPECULATIVE_WORKERS:
+            speculative_evaluations.inc(result='busy')
+            return
+        if cost > SPECULATIVE_TPM or speculative_budget.wait_time(cost, time.monotonic()) > 0:
+            speculative_evaluations.inc(result='over_budget')
+            return
+        speculative_budget.take(cost)
+        speculations_pending += 1
+
+    cancelled = threading.Event()
+    future = speculative_executor.submit(run_speculation, essay, source_text, cancelled)
+    future.add_done_callback(finish_speculation)
+    speculations.set(session_id, {
+        "key": key, "future": future, "cancelled": cancelled, "paragraphs": paragraph_texts(essay)
+    })
+    speculated_essays.set(key, True)
+    speculative_evaluations.inc(result='started')
+
+def run_speculation(essay, source_text, cancelled):
     try:
-        chat_completion = client.chat.completions.create(
-            messages=messages,
-            model="gpt-4o-mini",
-            response_format={
-                "type": "json_schema",
-                "json_schema": {
-                    "name": "evaluation_response",
-                    "schema": {
-                        "type": "object",
-                        "properties": {
-                            "assert_context": {"type": "array", "items": {"type": "string"}},
-                            "assert_reasoning": {"type": "array", "items": {"type": "string"}},
-                            "assert_suggestion": {"type": "array", "items": {"type": "string"}},
-                        },
-                        "required": ["assert_context", "assert_reasoning", "assert_suggestion"],
-                        "additionalProperties": False
-                    },
-                    "strict": True
-                }
-            }
-        )
-
-        # Parse the result
-        result = json.loads(chat_completion.choices[0].message.content)
-        assert_context = result.get('assert_context', [])
-        assert_reasoning = result.get('assert_reasoning', [])
-        assert_suggestion = result.get('assert_suggestion', [])
-
+        evaluate_essay(essay, source_text, use_cache=True, cancelled=cancelled)
+        speculative_evaluations.inc(result='cancelled' if cancelled.is_set() else 'completed')
     except Exception as e:
         print(f"Error: {e}")
-        assert_context = []
-        assert_reasoning = []
-        assert_suggestion = []
-
-
-    return jsonify({
-        "assert_context": assert_context,
-        "assert_reasoning": assert_reasoning,
-        "assert_suggestion": assert_suggestion,
-
-        })
+        speculative_evaluations.inc(result='failed')
+
+def finish_speculation(future):
+    global speculations_pending
+    with speculation_lock:
+        speculations_pending -= 1
+
+def cancel_speculation(session_id, text=None):
+    """
+    Stop a session's speculative evaluation from starting any more
+    analyses, unless `text` still has the speculated essay's paragraphs.
+    Calls already in flight finish and are cached.
+    """
+    speculation = speculations.get(session_id)
+    if speculation is None or speculation["cancelled"].is_set():
+        return
+    if text is not None and paragraph_texts(text) == speculation["paragraphs"]:
+        return
+    speculation["cancelled"].set()
+    if speculation["future"].cancel():
+        speculative_evaluations.inc(result='cancelled')
+
+def attach_speculation(session_id, essay):
+    """
+    Wait for the session's speculative evaluation if it is running on the
+    paragraphs of `essay`, so the findings it is fetching are reused instead
+    of requested again. One of other paragraphs is cancelled, and one still
+    queued is dropped; the caller then evaluates straight away.
+    """
+    cancel_speculation(session_id, essay)
+    speculation = speculations.get(session_id)
+    if speculation is None or speculation["cancelled"].is_set():
+        return
+    future = speculation["future"]
+    if future.cancel():
+        speculation["cancelled"].set()
+        speculative_evaluations.inc(result='cancelled')
+        return
+    if not future.done():
+        speculative_evaluations.inc(result='attached')
+    future.result()
+
+def paragraph_texts(text):
+    return tuple(text[start:end] for start, end in split_paragraphs(text))
 
 
 ####### CREATE DATABASE #######
 DATABASE = 'edits.db'
 
+# Shared connection pool; pragmas are applied once per pooled connection
+db = Database(
+    DATABASE,
+    on_query=lambda operation, statement, seconds: db_latency.observe(seconds, operation=operation, statement=statement)
+)
+
+def table_exists(cursor, name):
+    return cursor.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (name,)).fetchone() is not None
+
+def create_edit_search(cursor):
+    """
+    Full-text index over the phrase, suggestion and reasoning of every edit.
+    It reads its text from the edits table and triggers keep it in step;
+    an existing database is indexed once when the table is first created.
+    The session id is indexed too, so a search within one session intersects
+    its few rows instead of ranking every match across all sessions.
+    """
+    created = not table_exists(cursor, 'edits_fts')
+    cursor.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS edits_fts USING fts5(
+            session_id, phrase, suggestion, reasoning,
+            content='edits', content_rowid='id', tokenize='porter unicode61'
+        )
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS edits_fts_insert AFTER INSERT ON edits BEGIN
+            INSERT INTO edits_fts (rowid, session_id, phrase, suggestion, reasoning)
+            VALUES (NEW.id, NEW.session_id, NEW.phrase, NEW.suggestion, NEW.reasoning);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS edits_fts_delete AFTER DELETE ON edits BEGIN
+            INSERT INTO edits_fts (edits_fts, rowid, session_id, phrase, suggestion, reasoning)
+            VALUES ('delete', OLD.id, OLD.session_id, OLD.phrase, OLD.suggestion, OLD.reasoning);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS edits_fts_update AFTER UPDATE OF phrase, suggestion, reasoning ON edits BEGIN
+            INSERT INTO edits_fts (edits_fts, rowid, session_id, phrase, suggestion, reasoning)
+            VALUES ('delete', OLD.id, OLD.session_id, OLD.phrase, OLD.suggestion, OLD.reasoning);
+            INSERT INTO edits_fts (rowid, session_id, phrase, suggestion, reasoning)
+            VALUES (NEW.id, NEW.session_id, NEW.phrase, NEW.suggestion, NEW.reasoning);
+        END
+    ''')
+    if created:
+        cursor.execute("INSERT INTO edits_fts (edits_fts) VALUES ('rebuild')")
+
+def create_edit_summaries(cursor):
+    """
+    Edit counts kept up to date by triggers, so stats never scan the edits:
+    - edit_summaries: total and completed edits per session (document) and type
+    - edit_type_totals: the same across all sessions
+    - edit_phrase_counts: how often each phrase (lowercased) is flagged per type
+    Rows whose count drops to zero are deleted. Existing edits are counted
+    once when the tables are first created.
+    """
+    created = not table_exists(cursor, 'edit_summaries')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS edit_summaries (
+            session_id TEXT NOT NULL,
+            type TEXT NOT NULL,
+            total INTEGER NOT NULL,
+            completed INTEGER NOT NULL,
+            PRIMARY KEY (session_id, type)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS edit_type_totals (
+            type TEXT PRIMARY KEY,
+            total INTEGER NOT NULL,
+            completed INTEGER NOT NULL,
+            documents INTEGER NOT NULL
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS edit_phrase_counts (
+            type TEXT NOT NULL,
+            phrase TEXT NOT NULL,
+            total INTEGER NOT NULL,
+            PRIMARY KEY (type, phrase)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS edit_phrase_counts_type_total ON edit_phrase_counts (type, total)')
+
+    # Adding and removing one edit; an update of its type or completion is a removal then an addition
+    add = '''
+        INSERT INTO edit_type_totals (type, total, completed, documents)
+        VALUES (NEW.type, 1, NEW.completed != 0, NOT EXISTS (
+            SELECT 1 FROM edit_summaries WHERE session_id = NEW.session_id AND type = NEW.type
+        ))
+        ON CONFLICT(type) DO UPDATE SET
+            total = total + 1, completed = completed + excluded.completed, documents = documents + excluded.documents;
+        INSERT INTO edit_summaries (session_id, type, total, completed)
+        VALUES (NEW.session_id, NEW.type, 1, NEW.completed != 0)
+        ON CONFLICT(session_id, type) DO UPDATE SET total = total + 1, completed = completed + excluded.completed;
+    '''
+    remove = '''
+        UPDATE edit_summaries SET total = total - 1, completed = completed - (OLD.completed != 0)
+        WHERE session_id = OLD.session_id AND type = OLD.type;
+        UPDATE edit_type_totals SET
+            total = total - 1,
+            completed = completed - (OLD.completed != 0),
+            documents = documents - EXISTS (
+                SELECT 1 FROM edit_summaries WHERE session_id = OLD.session_id AND type = OLD.type AND total = 0
+            )
+        WHERE type = OLD.type;
+        DELETE FROM edit_summaries WHERE session_id = OLD.session_id AND type = OLD.type AND total = 0;
+        DELETE FROM edit_type_totals WHERE type = OLD.type AND total = 0;
+    '''
+    cursor.execute(f'CREATE TRIGGER IF NOT EXISTS edit_summaries_insert AFTER INSERT ON edits BEGIN {add} END')
+    cursor.execute(f'CREATE TRIGGER IF NOT EXISTS edit_summaries_delete AFTER DELETE ON edits BEGIN {remove} END')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS edit_summaries_update AFTER UPDATE OF type, completed ON edits BEGIN
+            {remove} {add}
+        END
+    ''')
+
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS edit_phrase_counts_insert AFTER INSERT ON edits BEGIN
+            INSERT INTO edit_phrase_counts (type, phrase, total) VALUES (NEW.type, lower(trim(NEW.phrase)), 1)
+            ON CONFLICT(type, phrase) DO UPDATE SET total = total + 1;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS edit_phrase_counts_delete AFTER DELETE ON edits BEGIN
+            UPDATE edit_phrase_counts SET total = total - 1 WHERE type = OLD.type AND phrase = lower(trim(OLD.phrase));
+            DELETE FROM edit_phrase_counts WHERE type = OLD.type AND phrase = lower(trim(OLD.phrase)) AND total = 0;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS edit_phrase_counts_update AFTER UPDATE OF type, phrase ON edits BEGIN
+            UPDATE edit_phrase_counts SET total = total - 1 WHERE type = OLD.type AND phrase = lower(trim(OLD.phrase));
+            DELETE FROM edit_phrase_counts WHERE type = OLD.type AND phrase = lower(trim(OLD.phrase)) AND total = 0;
+            INSERT INTO edit_phrase_counts (type, phrase, total) VALUES (NEW.type, lower(trim(NEW.phrase)), 1)
+            ON CONFLICT(type, phrase) DO UPDATE SET total = total + 1;
+        END
+    ''')
+
+    if created:
+        cursor.execute('''
+            INSERT INTO edit_summaries (session_id, type, total, completed)
+            SELECT session_id, type, COUNT(*), SUM(completed != 0) FROM edits GROUP BY session_id, type
+        ''')
+        cursor.execute('''
+            INSERT OR REPLACE INTO edit_type_totals (type, total, completed, documents)
+            SELECT type, SUM(total), SUM(completed), COUNT(*) FROM edit_summaries GROUP BY type
+        ''')
+        cursor.execute('''
+            INSERT OR REPLACE INTO edit_phrase_counts (type, phrase, total)
+            SELECT type, lower(trim(phrase)), COUNT(*) FROM edits GROUP BY type, lower(trim(phrase))
+        ''')
+
 def init_db():
-    """Create the edits table if it doesn't already exist."""
-    with sqlite3.connect(DATABASE) as conn:
+    """Configure the database and create the tables if they don't already exist."""
+    db.init()
+    with db.connection() as conn:
         cursor = conn.cursor()
+
+        # Tables from before rows were keyed by session held one shared,
+        # throwaway document (the page load wiped them), so rebuild them
+        for table in ('edits', 'user_edits'):
+            columns = [row['name'] for row in cursor.execute(f'PRAGMA table_info({table})')]
+            if columns and 'session_id' not in columns:
+                cursor.execute(f'DROP TABLE {table}')
+
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS sessions (
+                session_id TEXT PRIMARY KEY,
+                created_at REAL NOT NULL,
+                last_seen REAL NOT NULL
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS sessions_last_seen ON sessions (last_seen)')
+
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS edits (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
+                session_id TEXT NOT NULL,
                 type TEXT NOT NULL,
                 phrase TEXT NOT NULL,
                 suggestion TEXT NOT NULL,
@@ -433,39 +1216,277 @@ def init_db():
                 startIndex INTEGER NOT NULL,
                 endIndex INTEGER NOT NULL,
                 completed BOOLEAN NOT NULL,
-                UNIQUE(type, startIndex, endIndex)
+                version INTEGER NOT NULL DEFAULT 0,
+                UNIQUE(session_id, type, startIndex, endIndex)
+            )
+        ''')
+        if 'version' not in [row['name'] for row in cursor.execute('PRAGMA table_info(edits)')]:
+            cursor.execute('ALTER TABLE edits ADD COLUMN version INTEGER NOT NULL DEFAULT 0')
+        # Covering indexes for type and completion filters and counts, within a session and across them
+        cursor.execute('DROP INDEX IF EXISTS edits_session_type')
+        cursor.execute('CREATE INDEX IF NOT EXISTS edits_session_type_completed ON edits (session_id, type, completed)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS edits_type_completed ON edits (type, completed)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS edits_session_id ON edits (session_id, id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS edits_session_version ON edits (session_id, version)')
+
+        # Every insert, update and delete of an edit takes the next version
+        # from a database-wide clock, so /get-edits can return only what
+        # changed after a client's cursor. Deletions leave a tombstone.
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS edit_clock (
+                id INTEGER PRIMARY KEY CHECK (id = 0),
+                version INTEGER NOT NULL,
+                pruned_version INTEGER NOT NULL
+            )
+        ''')
+        cursor.execute('INSERT OR IGNORE INTO edit_clock (id, version, pruned_version) VALUES (0, 0, 0)')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS edit_tombstones (
+                session_id TEXT NOT NULL,
+                edit_id INTEGER NOT NULL,
+                version INTEGER NOT NULL,
+                created_at REAL NOT NULL
             )
-                       
-                       
         ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS edit_tombstones_session_version ON edit_tombstones (session_id, version)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS edit_tombstones_created_at ON edit_tombstones (created_at)')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS edits_version_insert AFTER INSERT ON edits BEGIN
+                UPDATE edit_clock SET version = version + 1;
+                UPDATE edits SET version = (SELECT version FROM edit_clock) WHERE id = NEW.id;
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS edits_version_update
+            AFTER UPDATE OF type, phrase, suggestion, reasoning, startIndex, endIndex, completed ON edits BEGIN
+                UPDATE edit_clock SET version = version + 1;
+                UPDATE edits SET version = (SELECT version FROM edit_clock) WHERE id = NEW.id;
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS edits_version_delete AFTER DELETE ON edits BEGIN
+                UPDATE edit_clock SET version = version + 1;
+                INSERT INTO edit_tombstones (session_id, edit_id, version, created_at)
+                VALUES (OLD.session_id, OLD.id, (SELECT version FROM edit_clock), CAST(strftime('%s', 'now') AS REAL));
+            END
+        ''')
+
+        create_edit_search(cursor)
+        create_edit_summaries(cursor)
 
+        # The response-box log used to hold free-text "Added: ...; Deleted: ..."
+        # summaries, which can't be replayed, so start the op log afresh
+        if 'edit_content' in [row['name'] for row in cursor.execute('PRAGMA table_info(user_edits)')]:
+            cursor.execute('DROP TABLE user_edits')
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS user_edits (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-                startIndex INTEGER NOT NULL,
-                endIndex INTEGER NOT NULL,
-                change_type TEXT NOT NULL,
-                edit_content TEXT NOT NULL
+                session_id TEXT NOT NULL,
+                version INTEGER NOT NULL,
+                position INTEGER NOT NULL,
+                removed INTEGER NOT NULL,
+                inserted TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                revision INTEGER NOT NULL DEFAULT 0,
+                UNIQUE(session_id, version)
+            )
+        ''')
+        if 'revision' not in [row['name'] for row in cursor.execute('PRAGMA table_info(user_edits)')]:
+            cursor.execute('ALTER TABLE user_edits ADD COLUMN revision INTEGER NOT NULL DEFAULT 0')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS document_snapshots (
+                session_id TEXT NOT NULL,
+                version INTEGER NOT NULL,
+                text TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (session_id, version)
             )
         ''')
 
-        conn.commit()
+        # Analyzer findings per (analyzer, paragraph hash), for incremental evaluation
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS paragraph_findings (
+                key TEXT PRIMARY KEY,
+                findings TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )
+        ''')
 
 # Call this function to initialize the database
 init_db()
 
-
-####### CLEAR DATABASE #######
-def clear_tables():
-    """Clear all data in the edits table."""
-    with sqlite3.connect(DATABASE) as conn:
+# Cache of LLM responses, kept in memory and in a table next to the edits
+llm_cache = ResponseCache(
+    db,
+    max_entries=int(os.getenv("LLM_CACHE_SIZE", "256")),
+    ttl=float(os.getenv("LLM_CACHE_TTL", "86400"))
+)
+llm_cache.prune()
+metrics.callback(
+    'rewrite_llm_cache_lookups_total', 'LLM response cache lookups by result.', ('result',),
+    lambda: {(result,): count for result, count in llm_cache.stats.items()},
+    kind='counter'
+)
+
+# Analyzer findings are queued here and committed in batches by a background thread
+edit_writer = WriteBehindWriter(db, '''
+    INSERT OR IGNORE INTO edits (session_id, type, phrase, suggestion, reasoning, startIndex, endIndex, completed)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+''')
+
+
+####### SESSIONS #######
+# Sessions idle for longer than this are deleted with their edits
+SESSION_TTL = float(os.getenv("SESSION_TTL", "86400"))
+SESSION_PRUNE_INTERVAL = 600
+# How long deleted edits are remembered for /get-edits?since=
+TOMBSTONE_TTL = 60 * 60
+
+# Lets benchmarks and tests choose their session with an X-Session-Id header
+# instead of the signed cookie. Any caller could then name any session, so
+# it is off unless set to 1, and only ids shaped like ours are accepted.
+SESSION_HEADER = os.getenv("SESSION_HEADER", "") == "1"
+SESSION_ID_RE = re.compile(r'[0-9a-f]{32}')
+
+# Sessions whose last_seen was written recently, so busy sessions don't
+# write to the sessions table on every request
+recently_seen = LRUCache(max_entries=4096, ttl=60)
+
+def start_session():
+    """Give the caller a fresh session id."""
+    session_id = uuid.uuid4().hex
+    session['session_id'] = session_id
+    touch_session(session_id)
+    return session_id
+
+def get_session_id():
+    """Return the caller's session id, creating one if needed."""
+    session_id = session.get('session_id')
+    if SESSION_HEADER:
+        header = request.headers.get('X-Session-Id')
+        if header is not None and SESSION_ID_RE.fullmatch(header):
+            session_id = header
+    if session_id is None:
+        return start_session()
+    touch_session(session_id)
+    return session_id
+
+def touch_session(session_id):
+    """Record that a session is still in use."""
+    if recently_seen.get(session_id):
+        return
+    now = time.time()
+    db.execute('''
+        INSERT INTO sessions (session_id, created_at, last_seen) VALUES (?, ?, ?)
+        ON CONFLICT(session_id) DO UPDATE SET last_seen = excluded.last_seen
+    ''', (session_id, now, now))
+    recently_seen.set(session_id, True)
+
+def prune_sessions():
+    """Delete sessions idle for longer than SESSION_TTL, along with their rows."""
+    edit_writer.flush()
+    expired = 'SELECT session_id FROM sessions WHERE last_seen < ?'
+    cutoff = time.time() - SESSION_TTL
+    with db.connection() as conn:
         cursor = conn.cursor()
-        cursor.execute('DELETE FROM edits')
-        cursor.execute('DELETE FROM sqlite_sequence WHERE name="edits"')
-        cursor.execute('DELETE FROM user_edits')
-        cursor.execute('DELETE FROM sqlite_sequence WHERE name="user_edits"')
-        conn.commit()
+        cursor.execute(f'DELETE FROM edits WHERE session_id IN ({expired})', (cutoff,))
+        cursor.execute(f'DELETE FROM edit_tombstones WHERE session_id IN ({expired})', (cutoff,))
+        cursor.execute(f'DELETE FROM user_edits WHERE session_id IN ({expired})', (cutoff,))
+        cursor.execute(f'DELETE FROM document_snapshots WHERE session_id IN ({expired})', (cutoff,))
+        cursor.execute('DELETE FROM sessions WHERE last_seen < ?', (cutoff,))
+
+def prune_tombstones():
+    """
+    Forget deletions older than TOMBSTONE_TTL. Clients whose cursor is
+    older than the newest forgotten one get a full resync.
+    """
+    cutoff = time.time() - TOMBSTONE_TTL
+    with db.connection() as conn:
+        newest = conn.execute('SELECT MAX(version) FROM edit_tombstones WHERE created_at < ?', (cutoff,)).fetchone()[0]
+        if newest is not None:
+            conn.execute('UPDATE edit_clock SET pruned_version = MAX(pruned_version, ?)', (newest,))
+            conn.execute('DELETE FROM edit_tombstones WHERE created_at < ?', (cutoff,))
+
+def prune_periodically():
+    while True:
+        time.sleep(SESSION_PRUNE_INTERVAL)
+        try:
+            prune_sessions()
+            prune_tombstones()
+            llm_cache.prune()
+            db.execute('DELETE FROM paragraph_findings WHERE created_at < ?', (time.time() - llm_cache.ttl,))
+        except Exception as e:
+            print(f"Error: {e}")
+
+threading.Thread(target=prune_periodically, name='session-prune', daemon=True).start()
+
+
+####### STORE EDITS #######
+def store_edits(session_id, edits):
+    """
+    Queue a session's analyzer edits for the background writer. Spans
+    already recorded for that type are skipped when the batch is written.
+    """
+    edit_writer.enqueue([(
+        session_id,
+        edit['type'],
+        edit['phrase'],
+        edit['suggestion'],
+        edit['reasoning'],
+        edit['startIndex'],
+        edit['endIndex'],
+        int(edit['completed'])
+    ) for edit in edits])
+
+def replace_edits(session_id, edits):
+    """
+    Replace a session's edits with a fresh evaluation in one transaction.
+    Findings the user already marked completed stay completed.
+    """
+    edit_writer.flush()
+    with db.connection() as conn:
+        completed = {
+            (row['type'], row['phrase'])
+            for row in conn.execute('SELECT type, phrase FROM edits WHERE session_id = ? AND completed', (session_id,))
+        }
+        conn.execute('DELETE FROM edits WHERE session_id = ?', (session_id,))
+        conn.executemany('''
+            INSERT OR IGNORE INTO edits (session_id, type, phrase, suggestion, reasoning, startIndex, endIndex, completed)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', [(
+            session_id,
+            edit['type'],
+            edit['phrase'],
+            edit['suggestion'],
+            edit['reasoning'],
+            edit['startIndex'],
+            edit['endIndex'],
+            int(edit['completed'] or (edit['type'], edit['phrase']) in completed)
+        ) for edit in edits])
+
+def fetch_edits(session_id, types=None, completed=None, after_id=None, limit=None):
+    """
+    Return a session's edits in id order, after any queued edits are
+    written, optionally only those of some types or completion state.
+    after_id and limit fetch one page at a time.
+    """
+    edit_writer.flush()
+    conditions = ['session_id = ?']
+    params = [session_id]
+    if types:
+        conditions.append(f"type IN ({', '.join('?' * len(types))})")
+        params.extend(types)
+    if completed is not None:
+        conditions.append('completed = ?')
+        params.append(int(completed))
+    if after_id is not None:
+        conditions.append('id > ?')
+        params.append(after_id)
+    sql = f"SELECT * FROM edits WHERE {' AND '.join(conditions)} ORDER BY id ASC"  # Ensure consistent order
+    if limit is not None:
+        sql += ' LIMIT ?'
+        params.append(limit)
+    return db.fetchall(sql, params)
 
 @app.route('/store-edits', methods=['POST'])
 def store_llm_edits():
@@ -482,23 +1503,21 @@ def store_llm_edits():
         else:
             edits = [data]
 
-        # Store edits in the SQLite database
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            for edit in edits:
-                cursor.execute('''
-                    INSERT INTO edits (type, phrase, suggestion, reasoning, startIndex, endIndex, completed)
-                    VALUES (?, ?, ?, ?, ?, ?, ?)
-                ''', (
-                    edit['type'],
-                    edit['phrase'],
-                    edit['suggestion'],
-                    edit['reasoning'],
-                    edit.get('startIndex'),
-                    edit.get('endIndex'),
-                    int(edit.get('completed', False))  # Store completed as 0 or 1
-                ))
-            conn.commit()
+        # Store edits in the SQLite database in one batch
+        session_id = get_session_id()
+        db.executemany('''
+            INSERT INTO edits (session_id, type, phrase, suggestion, reasoning, startIndex, endIndex, completed)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', [(
+            session_id,
+            edit['type'],
+            edit['phrase'],
+            edit['suggestion'],
+            edit['reasoning'],
+            edit.get('startIndex'),
+            edit.get('endIndex'),
+            int(edit.get('completed', False))  # Store completed as 0 or 1
+        ) for edit in edits])
 
         return jsonify({"message": "Edits stored successfully", "edits_count": len(edits)}), 200
 
@@ -509,23 +1528,25 @@ def store_llm_edits():
 ####### TOGGLE UPDATE COMPLETITION #######
 @app.route('/update-completion', methods=['POST'])
 def update_completion():
+    """Mark one of the session's edits completed or not, by its id."""
     try:
         data = request.get_json()
 
-        highlight_id = data.get('highlightId')
+        # highlightId is the name older clients send for the edit id
+        edit_id = data.get('id', data.get('highlightId'))
         completed = data.get('completed')
 
-        if highlight_id is None or completed is None:
-            return jsonify({"error": "Missing highlightId or completed status"}), 400
+        if edit_id is None or completed is None:
+            return jsonify({"error": "Missing id or completed status"}), 400
+
+        updated = db.execute('''
+            UPDATE edits
+            SET completed = ?
+            WHERE id = ? AND session_id = ?
+        ''', (int(bool(completed)), edit_id, get_session_id()))
 
-        with sqlite3.connect(DATABASE) as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
-                UPDATE edits
-                SET completed = ?
-                WHERE highlight_id = ?
-            ''', (completed, highlight_id))
-            conn.commit()
+        if not updated:
+            return jsonify({"error": "Edit not found"}), 404
 
         return jsonify({"message": "Completion status updated successfully"}), 200
 
@@ -535,103 +1556,573 @@ def update_completion():
     
 
 ####### USER EDITS #######
-# Store the last known state of the response-box
-last_response_text = ""
+# The response-box history is an operation log. Each user_edits row is one
+# replacement (position, characters removed, text inserted) and is the
+# document's next version. Typing or backspacing at the end of the latest
+# op within COALESCE_SECONDS extends that op instead of adding a row, and
+# every SNAPSHOT_INTERVAL versions the full text is saved, so any version
+# is rebuilt from the nearest snapshot plus fewer than SNAPSHOT_INTERVAL ops.
+# Extending an op in place bumps its revision, so a worker whose cached text
+# predates another worker's change sees it even though the version is equal.
+SNAPSHOT_INTERVAL = int(os.getenv("SNAPSHOT_INTERVAL", "50"))
+COALESCE_SECONDS = 2.0
+
+# Latest text, version, revision and open keystroke run of each session's
+# document, so tracking a change doesn't replay the log
+tracked_documents = LRUCache(max_entries=1024, ttl=6 * 60 * 60)
+tracked_documents_lock = threading.Lock()
 
 @app.route('/track-edits', methods=['POST'])
 def store_user_edits():
-    global last_response_text
+    """
+    Record how the response-box changed since the last call.
+
+    Accepts either the full text as responseBoxText, or a list of deltas
+    ({"start", "end", "text"}) applied in order to the last known text.
+    Returns the document's new version.
+    """
     try:
-        # Get the current text from the request
-        current_text = request.json.get('responseBoxText', '')
-        if current_text is None:
+        data = request.json
+        session_id = get_session_id()
+        deltas = data.get('deltas')
+        current_text = data.get('responseBoxText', '')
+        if deltas is None and current_text is None:
             return jsonify({"error": "responseBoxText is missing"}), 400
 
-        # Compare the current text with the last known text
-        if last_response_text != current_text:
-            # Find the difference
-            start_index, end_index, change_type, edit_content = calculate_edit(last_response_text, current_text)
+        with tracked_documents_lock, db.connection() as conn:
+            lock_for_write(conn)
+            document = current_document(conn, session_id)
+
+            if deltas is not None and document['version'] == 0:
+                return jsonify({"error": "Unknown document state, resend responseBoxText"}), 409
+
+            # Work on a copy so a failed write leaves the cached state alone;
+            # a bad delta rolls back the whole batch
+            document = dict(document, run=dict(document['run']) if document['run'] else None)
+            now = time.time()
+            changed = False
+            if deltas is not None:
+                # Each delta applies to the text as the ones before it left it
+                for delta in deltas:
+                    record_op(conn, session_id, document, *delta_op(document['text'], delta), now)
+                    changed = True
+            elif document['text'] != current_text:
+                # Only the section between the common prefix and suffix changed
+                record_op(conn, session_id, document, *diff_op(document['text'], current_text), now)
+                changed = True
+
+        tracked_documents.set(session_id, document)
+        if changed:
+            # The user is editing before evaluating; stop evaluating the old text
+            cancel_speculation(session_id, document['text'])
+        return jsonify({
+            "message": "Edit tracked successfully",
+            "length": len(document['text']),
+            "version": document['version'],
+        }), 200
+
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
-            # Save the change to the database
-            with sqlite3.connect(DATABASE) as conn:
-                cursor = conn.cursor()
-                cursor.execute('''
-                    INSERT INTO user_edits (start_index, end_index, change_type, edit_content)
-                    VALUES (?, ?, ?, ?)
-                ''', (start_index, end_index, change_type, edit_content))
-                conn.commit()
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
 
-            # Update the last known text
-            last_response_text = current_text
+@app.route('/get-document', methods=['GET'])
+def get_document():
+    """
+    Return the session's response-box text at a version (default: the latest).
 
-        return jsonify({"message": "Edit tracked successfully"}), 200
+    The response also carries the latest version, so a client can page back
+    through the drafts. The latest version can still grow while the user
+    keeps typing; /evaluate closes it and returns it as document_version.
+    """
+    try:
+        session_id = get_session_id()
+        version = request.args.get('version', type=int)
+        with db.connection() as conn:
+            latest, _ = latest_op(conn, session_id)
+            if version is None:
+                version = latest
+            if not 0 <= version <= latest:
+                return jsonify({"error": f"No version {version}, the latest is {latest}"}), 404
+            text = document_at(conn, session_id, version)
+
+        return jsonify({"text": text, "version": version, "latest_version": latest}), 200
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
-def calculate_edit(old_text, new_text):
-    """Calculate the edit details: start, end indices, type, and content of the change."""
-    diff = difflib.SequenceMatcher(None, old_text, new_text)
-    start_index = None
-    end_index = None
-    added_words = []
-    deleted_words = []
-
-    # Find changes in the text
-    for tag, i1, i2, j1, j2 in diff.get_opcodes():
-        if tag == 'replace':
-            deleted_words.append(old_text[i1:i2])
-            added_words.append(new_text[j1:j2])
-            if start_index is None:
-                start_index = j1
-            end_index = j2
-        elif tag == 'delete':
-            deleted_words.append(old_text[i1:i2])
-            if start_index is None:
-                start_index = j1
-            end_index = j2
-        elif tag == 'insert':
-            added_words.append(new_text[j1:j2])
-            if start_index is None:
-                start_index = j1
-            end_index = j2
-
-    # Combine added and deleted words for logging
-    edit_content = f"Added: {' '.join(added_words)}; Deleted: {' '.join(deleted_words)}"
-
-    # Determine the type of change
-    change_length = len(new_text) - len(old_text)
-    change_type = "new essay" if abs(change_length) > 1000 else "user edit"
-
-    # Handle cases where no explicit diff is found
-    if start_index is None or end_index is None:
-        start_index = 0
-        end_index = len(new_text)
-
-    return start_index, end_index, change_type, edit_content
-
-def get_db_connection():
-    """Establish and return a database connection."""
-    connection = sqlite3.connect(DATABASE)
-    connection.row_factory = sqlite3.Row
-    return connection
+def current_document(conn, session_id):
+    """
+    Return the session's tracked document, rebuilding it from the log when
+    it isn't cached or another worker has written to the log since.
+    """
+    latest, revision = latest_op(conn, session_id)
+    document = tracked_documents.get(session_id)
+    if document is None or (document['version'], document['revision']) != (latest, revision):
+        document = {"text": document_at(conn, session_id, latest), "version": latest, "revision": revision, "run": None}
+    return document
+
+def seal_document(session_id):
+    """
+    Close the document's open keystroke run so its current version stays
+    as it is, and return that version. Bumping the op's revision makes
+    other workers with a run open on it start a new version instead.
+    """
+    with tracked_documents_lock, db.connection() as conn:
+        lock_for_write(conn)
+        version, revision = latest_op(conn, session_id)
+        if version:
+            conn.execute(
+                'UPDATE user_edits SET revision = revision + 1 WHERE session_id = ? AND version = ?',
+                (session_id, version)
+            )
+            document = tracked_documents.get(session_id)
+            if document is not None and (document['version'], document['revision']) == (version, revision):
+                document['revision'] = revision + 1
+                document['run'] = None
+        return version
+
+def lock_for_write(conn):
+    """
+    Take the database write lock before reading the log, so no other worker
+    writes between the read and this transaction's own writes.
+    """
+    if not conn.in_transaction:
+        conn.execute('BEGIN IMMEDIATE')
+
+def latest_op(conn, session_id):
+    """(version, revision) of the session's latest op, (0, 0) before the first."""
+    row = conn.execute(
+        'SELECT version, revision FROM user_edits WHERE session_id = ? ORDER BY version DESC LIMIT 1', (session_id,)
+    ).fetchone()
+    return (row['version'], row['revision']) if row else (0, 0)
+
+def document_at(conn, session_id, version):
+    """Rebuild the text at a version from the nearest snapshot and the ops after it."""
+    snapshot = conn.execute('''
+        SELECT version, text FROM document_snapshots
+        WHERE session_id = ? AND version <= ?
+        ORDER BY version DESC LIMIT 1
+    ''', (session_id, version)).fetchone()
+    start, text = (snapshot['version'], snapshot['text']) if snapshot else (0, "")
+
+    for op in conn.execute('''
+        SELECT position, removed, inserted FROM user_edits
+        WHERE session_id = ? AND version > ? AND version <= ?
+        ORDER BY version ASC
+    ''', (session_id, start, version)):
+        text = apply_op(text, op['position'], op['removed'], op['inserted'])
+    return text
+
+def record_op(conn, session_id, document, position, removed, inserted, now):
+    """Append one op to the log, or extend the open keystroke run with it."""
+    run = document['run']
+    if run is not None and now - run['updated'] <= COALESCE_SECONDS:
+        run_end = run['position'] + len(run['inserted'])
+        merged = None
+        if removed == 0 and position == run_end:
+            # Typing on at the end of the run
+            merged = run['inserted'] + inserted
+        elif not inserted and position + removed == run_end and removed <= len(run['inserted']):
+            # Backspacing over text the run typed
+            merged = run['inserted'][:len(run['inserted']) - removed]
+
+        if merged is not None:
+            conn.execute(
+                'UPDATE user_edits SET inserted = ?, created_at = ?, revision = revision + 1 WHERE session_id = ? AND version = ?',
+                (merged, now, session_id, document['version'])
+            )
+            document['text'] = apply_op(document['text'], position, removed, inserted)
+            document['revision'] += 1
+            run['inserted'] = merged
+            run['updated'] = now
+            return
+
+    version = document['version'] + 1
+    conn.execute('''
+        INSERT INTO user_edits (session_id, version, position, removed, inserted, created_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', (session_id, version, position, removed, inserted, now))
+    document['text'] = apply_op(document['text'], position, removed, inserted)
+    document['version'] = version
+    document['revision'] = 0
+
+    if version % SNAPSHOT_INTERVAL == 0:
+        conn.execute(
+            'INSERT OR REPLACE INTO document_snapshots (session_id, version, text, created_at) VALUES (?, ?, ?, ?)',
+            (session_id, version, document['text'], now)
+        )
+        # A snapshotted version must not change afterwards
+        document['run'] = None
+    else:
+        document['run'] = {"position": position, "inserted": inserted, "updated": now}
+
+def apply_op(text, position, removed, inserted):
+    return text[:position] + inserted + text[position + removed:]
+
+def delta_op(text, delta):
+    """Turn a client-sent {"start", "end", "text"} replacement into an op, checking its bounds."""
+    start = delta['start']
+    end = delta.get('end', start)
+    if not 0 <= start <= end <= len(text):
+        raise ValueError(f"Delta {start}-{end} is outside the document")
+    return start, end - start, delta.get('text', '')
+
+def common_prefix_length(a, b):
+    """Length of the common prefix, found by binary search over slice compares."""
+    low, high = 0, min(len(a), len(b))
+    while low < high:
+        mid = (low + high + 1) // 2
+        if a[:mid] == b[:mid]:
+            low = mid
+        else:
+            high = mid - 1
+    return low
+
+def common_suffix_length(a, b):
+    """Length of the common suffix, found by binary search over slice compares."""
+    low, high = 0, min(len(a), len(b))
+    while low < high:
+        mid = (low + high + 1) // 2
+        if a[len(a) - mid:] == b[len(b) - mid:]:
+            low = mid
+        else:
+            high = mid - 1
+    return low
+
+def diff_op(old_text, new_text):
+    """The single (position, removed, inserted) op that turns old_text into new_text."""
+    prefix = common_prefix_length(old_text, new_text)
+    suffix = common_suffix_length(old_text[prefix:], new_text[prefix:])
+    return prefix, len(old_text) - prefix - suffix, new_text[prefix:len(new_text) - suffix]
+
+# Full /get-edits responses with more edits than this are streamed page by page
+EDITS_PAGE_SIZE = 500
 
 @app.route('/get-edits', methods=['GET'])
 def get_edits():
-    """Retrieve all edits from the database."""
+    """
+    Retrieve the session's edits from the database.
+
+    Optional query parameters:
+    - type: only edits of these types (repeat it or separate with commas)
+    - completed: only completed (true) or open (false) edits
+    - since: the cursor from an earlier response. Only edits added or
+      changed after it are returned, and "deleted" lists the ids of edits
+      removed since then or no longer matching the filters. "full" is true
+      when the cursor was too old and every matching edit was returned.
+
+    The ETag is the session's edit version, so If-None-Match gets a 304
+    without reading any edits when nothing changed.
+    """
     try:
-        with get_db_connection() as conn:
-            conn.execute("PRAGMA journal_mode=WAL;")  # Enable WAL for better concurrency
-            conn.commit()  # Ensure all pending writes are committed
-            cursor = conn.cursor()
-            cursor.execute("SELECT * FROM edits ORDER BY id ASC")  # Ensure consistent order
-            edits = [dict(row) for row in cursor.fetchall()]
+        session_id = get_session_id()
+        edit_writer.flush()
+
+        version = edits_version(session_id)
+
+        def build():
+            since = request.args.get('since', type=int)
+            types, completed = edit_filters()
 
-        return jsonify({'edits': edits}), 200
+            full = since is None or since < db.fetchone('SELECT pruned_version FROM edit_clock')['pruned_version']
+            if full:
+                edits, deleted = fetch_edits(session_id, types, completed, limit=EDITS_PAGE_SIZE), []
+            else:
+                edits, deleted = fetch_edit_changes(session_id, since, types, completed)
+
+            if full and len(edits) == EDITS_PAGE_SIZE:
+                return stream_edits(session_id, types, completed, edits, version)
+            return jsonify({'edits': edits, 'deleted': deleted, 'cursor': version, 'full': full})
+
+        return versioned_response(version, build)
 
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def stream_edits(session_id, types, completed, first_page, cursor):
+    """
+    Send a full edit list one page at a time, so a large session's edits
+    are never all held in memory at once.
+    """
+    def generate():
+        yield b'{"deleted":[],"cursor":%d,"full":true,"edits":[' % cursor
+        page = first_page
+        separator = b''
+        while page:
+            yield separator + b','.join(dumps(edit) for edit in page)
+            separator = b','
+            if len(page) < EDITS_PAGE_SIZE:
+                break
+            page = fetch_edits(session_id, types, completed, after_id=page[-1]['id'], limit=EDITS_PAGE_SIZE)
+        yield b']}'
+    return Response(generate(), mimetype='application/json')
+
+def edit_filters():
+    """Read the type and completed filters of an edits request."""
+    types = [t for value in request.args.getlist('type') for t in value.split(',') if t]
+    completed = request.args.get('completed')
+    if completed is not None:
+        completed = completed.lower() in ('1', 'true')
+    return types, completed
+
+def versioned_response(version, build):
+    """
+    Answer a GET of a session's edit data: a 304 if the client's ETag is
+    still the session's edit version, otherwise the response from build().
+    Either way the version is the ETag and the response is private to the
+    session.
+    """
+    if request.if_none_match.contains_weak(str(version)):
+        response = Response(status=304)
+    else:
+        response = build()
+    response.set_etag(str(version))
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.headers['Vary'] = 'Cookie, X-Session-Id'
+    return response
+
+def edits_version(session_id):
+    """Version of the session's latest edit change, deletions included (0 if none)."""
+    return db.fetchone('''
+        SELECT MAX(
+            (SELECT COALESCE(MAX(version), 0) FROM edits WHERE session_id = ?),
+            (SELECT COALESCE(MAX(version), 0) FROM edit_tombstones WHERE session_id = ?)
+        ) AS version
+    ''', (session_id, session_id))['version']
+
+def fetch_edit_changes(session_id, since, types=None, completed=None):
+    """
+    Return (edits, deleted ids) changed after version `since`. Changed edits
+    that no longer match the filters count as deleted for this client.
+    """
+    edits, deleted = [], []
+    for edit in db.fetchall(
+        'SELECT * FROM edits WHERE session_id = ? AND version > ? ORDER BY id ASC',
+        (session_id, since)
+    ):
+        if (not types or edit['type'] in types) and (completed is None or bool(edit['completed']) == completed):
+            edits.append(edit)
+        else:
+            deleted.append(edit['id'])
+
+    deleted.extend(row['edit_id'] for row in db.fetchall(
+        'SELECT edit_id FROM edit_tombstones WHERE session_id = ? AND version > ?',
+        (session_id, since)
+    ))
+    return edits, deleted
+
+
+####### HIGHLIGHT SEGMENTS #######
+@app.route('/get-segments', methods=['GET'])
+def get_segments():
+    """
+    Split the session's essay into flat highlight segments from its stored edits.
+
+    Overlapping findings are resolved by one sweep over their
+    (startIndex, endIndex) spans, so every segment lists the ids and types
+    of all edits covering it and the client renders the essay in a single
+    pass. Optional query parameters:
+    - length: essay length; segments then cover the whole essay and spans
+      past its end are clipped
+    - type, completed: the same filters as /get-edits
+    """
+    try:
+        session_id = get_session_id()
+        edit_writer.flush()
+
+        # The ETag only depends on the edits, the URL carries the parameters
+        version = edits_version(session_id)
+
+        def build():
+            length = request.args.get('length', type=int)
+            types, completed = edit_filters()
+
+            edits = fetch_edits(session_id, types, completed)
+            segments = segment_spans(
+                ((edit['startIndex'], edit['endIndex'], edit['id'], edit['type']) for edit in edits),
+                length
+            )
+            return jsonify({'segments': segments, 'edits': edits, 'cursor': version})
+
+        return versioned_response(version, build)
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+####### SEARCH AND STATS #######
+# Bearer token that unlocks scope=all (every session's edits) on the search
+# and stats routes; without it they only cover the caller's own session
+STATS_TOKEN = os.getenv("STATS_TOKEN")
+
+SEARCH_LIMIT = 50
+MAX_SEARCH_LIMIT = 500
+TOP_PHRASES = 10
+
+# Column weights for bm25 ranking: session id (filter only), phrase, suggestion, reasoning
+SEARCH_WEIGHTS = (0.0, 4.0, 2.0, 1.0)
+
+SEARCH_WORD_RE = re.compile(r'\w+')
+
+def search_scope():
+    """
+    Session id the request is limited to, or None for scope=all. Raises
+    PermissionError if scope=all is asked for without the stats token.
+    """
+    if request.args.get('scope') != 'all':
+        return get_session_id()
+    token = request.headers.get('Authorization', '').removeprefix('Bearer ')
+    if not STATS_TOKEN or not hmac.compare_digest(token, STATS_TOKEN):
+        raise PermissionError("scope=all needs the stats token")
+    return None
+
+def fts_string(text):
+    return '"' + text.replace('"', '""') + '"'
+
+def match_query(text, session_id=None):
+    """
+    Turn free text into an FTS5 query for edits whose phrase, suggestion or
+    reasoning contain every word (stemmed, so "utilizing" finds "utilize"),
+    optionally within one session. Quoting each word keeps FTS5 operators
+    and punctuation in user input from parsing. Returns None without words.
+    """
+    words = SEARCH_WORD_RE.findall(text)
+    if not words:
+        return None
+    query = '{phrase suggestion reasoning} : (' + ' '.join(fts_string(word) for word in words) + ')'
+    if session_id is not None:
+        query = f'session_id : {fts_string(session_id)} AND {query}'
+    return query
+
+@app.route('/search-edits', methods=['GET'])
+def search_edits():
+    """
+    Full-text search over the phrase, suggestion and reasoning of stored edits,
+    best matches first.
+
+    Query parameters:
+    - q: words to search for (required)
+    - type, completed: the same filters as /get-edits
+    - limit: number of results (default SEARCH_LIMIT, at most MAX_SEARCH_LIMIT)
+    - scope: "all" to search every session's edits (needs the stats token)
+    """
+    try:
+        if not SEARCH_WORD_RE.search(request.args.get('q', '')):
+            return jsonify({"error": "Invalid request, 'q' must contain a word"}), 400
+        session_id = search_scope()
+        types, completed = edit_filters()
+        limit = min(max(request.args.get('limit', SEARCH_LIMIT, type=int), 1), MAX_SEARCH_LIMIT)
+        edit_writer.flush()
+
+        conditions = ['edits_fts MATCH ?']
+        params = [match_query(request.args['q'], session_id)]
+        if session_id is not None:
+            # The index matches session ids by their tokens; this makes it exact
+            conditions.append('edits.session_id = ?')
+            params.append(session_id)
+        if types:
+            conditions.append(f"edits.type IN ({', '.join('?' * len(types))})")
+            params.extend(types)
+        if completed is not None:
+            conditions.append('edits.completed = ?')
+            params.append(int(completed))
+        params.append(limit)
+
+        weights = ', '.join(str(weight) for weight in SEARCH_WEIGHTS)
+        results = db.fetchall(f'''
+            SELECT edits.*, bm25(edits_fts, {weights}) AS rank
+            FROM edits_fts JOIN edits ON edits.id = edits_fts.rowid
+            WHERE {' AND '.join(conditions)}
+            ORDER BY rank LIMIT ?
+        ''', params)
+        return jsonify({'edits': results})
+
+    except PermissionError as e:
+        return jsonify({"error": str(e)}), 403
+    except Exception as e:
+        print(f"Error: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/edit-stats', methods=['GET'])
+def edit_stats():
+    """
+    Edit counts from the summary tables the edit triggers keep up to date.
+
+    By default: total and completed edits per type for the caller's
+    session, with an ETag like /get-edits. With scope=all (needs the stats
+    token): the same across every session, how many sessions have edits of
+    each type and their average per session, plus the most flagged phrases
+    of each type (`phrases` of them, default TOP_PHRASES). type limits the
+    types reported.
+    """
+    try:
+        session_id = search_scope()
+        types, _ = edit_filters()
+        edit_writer.flush()
+
+        if session_id is not None:
+            def build():
+                rows = db.fetchall('SELECT type, total, completed FROM edit_summaries WHERE session_id = ?', (session_id,))
+                return jsonify(summarize_types(rows, types))
+            return versioned_response(edits_version(session_id), build)
+
+        rows = db.fetchall('SELECT type, total, completed, documents FROM edit_type_totals')
+        stats = summarize_types(rows, types)
+        phrases = min(max(request.args.get('phrases', TOP_PHRASES, type=int), 0), MAX_SEARCH_LIMIT)
+        documents = {row['type']: row['documents'] for row in rows}
+        for edit_type, count in stats['types'].items():
+            count['documents'] = documents.get(edit_type, 0)
+            count['per_document'] = count['total'] / count['documents'] if count['documents'] else 0.0
+        stats['sessions'] = db.fetchone('SELECT COUNT(*) AS count FROM sessions')['count']
+        stats['top_phrases'] = {
+            edit_type: db.fetchall(
+                'SELECT phrase, total FROM edit_phrase_counts WHERE type = ? ORDER BY total DESC LIMIT ?',
+                (edit_type, phrases)
+            )
+            for edit_type in stats['types']
+        }
+        return jsonify(stats)
+
+    except PermissionError as e:
+        return jsonify({"error": str(e)}), 403
+    except Exception as e:
+        print(f"Error: {e}")
+        return jsonify({"error": str(e)}), 500
+
+def summarize_types(rows, types=None):
+    """Per-type totals and completion rates from summary rows, with every analyzer listed."""
+    counts = {edit_type: {'total': 0, 'completed': 0} for edit_type in ANALYZERS}
+    for row in rows:
+        counts[row['type']] = {'total': row['total'], 'completed': row['completed']}
+    if types:
+        counts = {edit_type: count for edit_type, count in counts.items() if edit_type in types}
+    for count in counts.values():
+        count['completion_rate'] = count['completed'] / count['total'] if count['total'] else 0.0
+    return {
+        'types': counts,
+        'total': sum(count['total'] for count in counts.values()),
+        'completed': sum(count['completed'] for count in counts.values()),
+    }
+
+
+####### SHUTDOWN #######
+
+def shutdown():
+    """Let running evaluations finish, write queued edits and close pooled connections."""
+    # Speculations still queued are dropped; running ones need the evaluate pool
+    speculative_executor.shutdown(wait=True, cancel_futures=True)
+    evaluate_executor.shutdown(wait=True)
+    edit_writer.close()
+    db.close()
+    if METRICS_DIR:
+        # Counts from this worker stay in the combined totals after it exits
+        metrics.write_snapshot()
+
+atexit.register(shutdown)
+
 
 if __name__ == "__main__":
+    # Development server; use `gunicorn chatgpt_api:app` in production (see gunicorn.conf.py)
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,198 @@
+"""Pooled SQLite access shared by the request handlers."""
+from contextlib import contextmanager
+import sqlite3
+import threading
+import time
+
+
+class Database:
+    """
+    Small pool of pre-configured SQLite connections.
+
+    A thread checks a connection out for the length of a `with` block and
+    gets the same one back if it nests blocks, so handlers never pay for
+    sqlite3.connect() or pragma setup per request. Connections keep a large
+    statement cache, so repeated queries reuse their prepared statements.
+    """
+
+    def __init__(self, path, max_idle=8, busy_timeout=5000, mmap_size=64 * 1024 * 1024, cached_statements=256,
+                 on_query=None):
+        self.path = path
+        # Called as on_query(operation, statement, seconds) after each helper query
+        self.on_query = on_query
+        self.max_idle = max_idle
+        self.busy_timeout = busy_timeout
+        self.mmap_size = mmap_size
+        self.cached_statements = cached_statements
+        self.idle = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def init(self):
+        """One-time, database-wide setup. WAL mode persists in the file itself."""
+        with self.connection() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+
+    def connect(self):
+        conn = sqlite3.connect(
+            self.path,
+            timeout=self.busy_timeout / 1000,
+            check_same_thread=False,
+            cached_statements=self.cached_statements
+        )
+        conn.row_factory = sqlite3.Row
+        # Per-connection settings, applied once when the connection is opened
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(f'PRAGMA busy_timeout={int(self.busy_timeout)}')
+        conn.execute(f'PRAGMA mmap_size={int(self.mmap_size)}')
+        return conn
+
+    @contextmanager
+    def connection(self):
+        """
+        Check out a connection. Commits when the outermost block exits
+        normally and rolls back if it raises.
+        """
+        conn = getattr(self.local, 'conn', None)
+        if conn is not None:
+            # Nested use on the same thread shares the outer transaction
+            yield conn
+            return
+
+        with self.lock:
+            conn = self.idle.pop() if self.idle else None
+        if conn is None:
+            conn = self.connect()
+
+        self.local.conn = conn
+        try:
+            yield conn
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            self.local.conn = None
+            with self.lock:
+                if len(self.idle) < self.max_idle:
+                    self.idle.append(conn)
+                    conn = None
+            if conn is not None:
+                conn.close()
+
+    @contextmanager
+    def timed(self, operation, sql):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            if self.on_query is not None:
+                statement = sql.split(None, 1)[0].upper() if sql.strip() else ''
+                self.on_query(operation, statement, time.perf_counter() - start)
+
+    def execute(self, sql, params=()):
+        """Run one statement in its own transaction and return the row count."""
+        with self.timed('execute', sql), self.connection() as conn:
+            return conn.execute(sql, params).rowcount
+
+    def executemany(self, sql, seq_of_params):
+        """Run one statement for every parameter set in a single transaction."""
+        with self.timed('executemany', sql), self.connection() as conn:
+            return conn.executemany(sql, seq_of_params).rowcount
+
+    def fetchall(self, sql, params=()):
+        """Return every row of a query as a list of dicts."""
+        with self.timed('fetchall', sql), self.connection() as conn:
+            return [dict(row) for row in conn.execute(sql, params)]
+
+    def fetchone(self, sql, params=()):
+        """Return the first row of a query as a dict, or None."""
+        with self.timed('fetchone', sql), self.connection() as conn:
+            row = conn.execute(sql, params).fetchone()
+        return dict(row) if row is not None else None
+
+    def close(self):
+        """Close every idle connection."""
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for conn in idle:
+            conn.close()
+
+
+class WriteBehindWriter:
+    """
+    Background writer that batches inserts into a single transaction.
+
+    Callers enqueue parameter tuples for one INSERT statement and return
+    immediately. A daemon thread commits everything queued so far at most
+    every `interval` seconds. flush() is a read barrier: it returns once
+    every row enqueued before the call has been committed.
+    """
+
+    def __init__(self, db, sql, interval=0.05, max_batch=1000):
+        self.db = db
+        self.sql = sql
+        self.interval = interval
+        self.max_batch = max_batch
+        self.pending = []
+        self.enqueued = 0
+        self.written = 0
+        self.errors = 0
+        self.condition = threading.Condition()
+        self.wakeup = threading.Event()
+        self.stopping = False
+        self.thread = threading.Thread(target=self.run, name='write-behind', daemon=True)
+        self.thread.start()
+
+    def enqueue(self, rows):
+        """Queue rows for writing and return without waiting."""
+        rows = list(rows)
+        if not rows:
+            return
+        with self.condition:
+            self.pending.extend(rows)
+            self.enqueued += len(rows)
+
+    def flush(self, timeout=None):
+        """Wait until every row enqueued so far is committed. Returns False on timeout."""
+        with self.condition:
+            target = self.enqueued
+            if self.written >= target:
+                return True
+            self.wakeup.set()
+            return self.condition.wait_for(lambda: self.written >= target, timeout)
+
+    def run(self):
+        while True:
+            self.wakeup.wait(self.interval)
+            self.wakeup.clear()
+
+            with self.condition:
+                batch, self.pending = self.pending[:self.max_batch], self.pending[self.max_batch:]
+                if self.pending:
+                    # More than one batch queued; come straight back for the rest
+                    self.wakeup.set()
+                stopping = self.stopping
+
+            if batch:
+                try:
+                    self.db.executemany(self.sql, batch)
+                except Exception as e:
+                    print(f"Error: {e}")
+                    with self.condition:
+                        self.errors += 1
+
+                # Rows are counted as written even if the batch failed so
+                # readers waiting on flush() are never stuck
+                with self.condition:
+                    self.written += len(batch)
+                    self.condition.notify_all()
+            elif stopping:
+                return
+
+    def close(self):
+        """Write everything still queued and stop the writer thread."""
+        with self.condition:
+            self.stopping = True
+        self.wakeup.set()
+        self.thread.join()
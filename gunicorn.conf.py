@@ -0,0 +1,71 @@
+"""
+Production serving config: `gunicorn chatgpt_api:app` (read automatically
+from this directory).
+
+Workers are gevent processes. Each request runs in a greenlet and sockets
+are cooperative, so a request waiting on OpenAI costs a few KB of memory
+instead of a blocked OS thread, and one worker holds hundreds of in-flight
+LLM calls. FLASK_SECRET_KEY is required, so every worker accepts the
+session cookies signed by the others. Everything else is configurable
+through the environment:
+
+    WEB_WORKERS          worker processes (default: one per CPU)
+    WORKER_CONNECTIONS   concurrent requests per worker (default 1000)
+    BIND                 address to listen on (default 0.0.0.0:8000)
+    GRACEFUL_TIMEOUT     seconds in-flight requests get to finish on
+                         SIGTERM/SIGINT before workers are killed (default 60)
+    WORKER_TIMEOUT       seconds a worker may stop responding before it is
+                         restarted (default 120)
+    ACCESS_LOG           access log path, "-" for stdout (default), empty to
+                         disable
+    METRICS_DIR          directory where workers pool their metrics
+                         (default: a new temporary directory)
+"""
+import glob
+import multiprocessing
+import os
+import sys
+import tempfile
+
+from dotenv import load_dotenv
+
+# The app reads the same file; loaded here too so the check below sees it
+load_dotenv('api_key.env')
+
+# Every worker is its own process, so each would generate a different random
+# key and reject the session cookies signed by the others
+if not os.getenv("FLASK_SECRET_KEY"):
+    sys.exit("FLASK_SECRET_KEY must be set when running under gunicorn (e.g. in api_key.env)")
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+worker_class = "gevent"
+workers = int(os.getenv("WEB_WORKERS", str(multiprocessing.cpu_count())))
+worker_connections = int(os.getenv("WORKER_CONNECTIONS", "1000"))
+
+# Async workers heartbeat from their own greenlet, so this only fires if a
+# worker's event loop is blocked, not for slow LLM calls
+timeout = int(os.getenv("WORKER_TIMEOUT", "120"))
+graceful_timeout = int(os.getenv("GRACEFUL_TIMEOUT", "60"))
+keepalive = 5
+
+# Workers pool their metrics here so /metrics reports totals across all of
+# them, whichever worker answers the scrape
+os.environ.setdefault("METRICS_DIR", tempfile.mkdtemp(prefix="rewrite-metrics-"))
+
+# Greenlets are cheap, so /evaluate fan-out no longer needs a small thread cap
+os.environ.setdefault("EVALUATE_WORKERS", str(worker_connections))
+
+accesslog = os.getenv("ACCESS_LOG", "-") or None
+
+
+def on_starting(server):
+    """Start counting from zero rather than from a previous run's snapshots."""
+    for path in glob.glob(os.path.join(os.environ["METRICS_DIR"], "*.json")):
+        os.remove(path)
+
+
+def worker_exit(server, worker):
+    """Finish queued edit writes and close connections before the worker exits."""
+    app_module = sys.modules.get("chatgpt_api")
+    if app_module is not None:
+        app_module.shutdown()
@@ -0,0 +1,134 @@
+"""Local word-difficulty screening from a bundled word-frequency list."""
+from functools import lru_cache
+import gzip
+import os
+import re
+
+from retrieval import split_sentences
+
+LEXICON_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'word_frequencies_en.txt.gz')
+
+# Zipf value (log10 of occurrences per billion words) assumed for words
+# missing from the list, which stops at 3.0
+UNLISTED_ZIPF = 2.5
+
+# Words at least this frequent are never flagged
+COMMON_ZIPF = 4.0
+
+# Difficulty at or above COMPLEX is flagged without asking the model;
+# between AMBIGUOUS and COMPLEX the model decides
+COMPLEX = 2.5
+AMBIGUOUS = 1.0
+
+# Shorter words are skipped outright
+MIN_LENGTH = 5
+
+# Endings typical of academic, Latinate vocabulary
+ACADEMIC_SUFFIXES = (
+    'ization', 'isation', 'ological', 'ology', 'ality', 'ivity', 'icity', 'aneous', 'itious', 'escence',
+    'ibility', 'ability', 'ematic', 'iferous', 'ulous', 'iosity', 'itude', 'istic', 'ectomy', 'ification'
+)
+
+# (ending, replacement) pairs tried to find a listed base form of an unlisted word
+INFLECTIONS = (
+    ('ies', 'y'), ('es', ''), ('s', ''), ('ied', 'y'), ('ed', ''), ('ed', 'e'), ('ing', ''), ('ing', 'e'),
+    ('ly', ''), ('ily', 'y'), ('er', ''), ('est', ''), ('ness', ''), ('ment', ''), ('ful', ''), ('less', '')
+)
+
+# Derived forms are rarer than their base word
+DERIVED_PENALTY = 0.5
+
+WORD_RE = re.compile(r"[A-Za-z]+")
+VOWEL_GROUP_RE = re.compile(r'[aeiouy]+')
+
+
+@lru_cache(maxsize=1)
+def load_lexicon(path=LEXICON_PATH):
+    """Read the word list into a {word: zipf} dict, once per process."""
+    lexicon = {}
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            if line.startswith('#') or not line.strip():
+                continue
+            zipf, words = line.rstrip('\n').split('\t')
+            zipf = float(zipf)
+            for word in words.split():
+                lexicon[word] = zipf
+    return lexicon
+
+
+def count_syllables(word):
+    """Approximate syllable count from vowel groups, for lowercase words."""
+    count = len(VOWEL_GROUP_RE.findall(word))
+    # A final silent "e" ("structure"), but not "-le" ("table")
+    if word.endswith('e') and not word.endswith(('le', 'ee')) and count > 1:
+        count -= 1
+    return max(count, 1)
+
+
+def word_zipf(word, lexicon):
+    """Zipf frequency of a lowercase word, falling back to a listed base form."""
+    if word in lexicon:
+        return lexicon[word]
+
+    best = None
+    for ending, replacement in INFLECTIONS:
+        if word.endswith(ending) and len(word) - len(ending) >= 3:
+            base = word[:-len(ending)] + replacement
+            # "stopped" -> "stop"
+            if base not in lexicon and replacement == '' and len(base) > 3 and base[-1] == base[-2]:
+                base = base[:-1]
+            if base in lexicon and (best is None or lexicon[base] > best):
+                best = lexicon[base]
+    return best - DERIVED_PENALTY if best is not None else UNLISTED_ZIPF
+
+
+def difficulty(word, lexicon):
+    """
+    Score how hard a lowercase word is to read: rarity below COMMON_ZIPF,
+    plus a half point per syllable past two and a bonus for academic endings.
+    Returns (score, zipf, syllables).
+    """
+    zipf = word_zipf(word, lexicon)
+    syllables = count_syllables(word)
+    if zipf >= COMMON_ZIPF:
+        return 0.0, zipf, syllables
+
+    score = (COMMON_ZIPF - zipf) + 0.5 * max(0, syllables - 2)
+    if word.endswith(ACADEMIC_SUFFIXES):
+        score += 0.75
+    return score, zipf, syllables
+
+
+def screen_words(text, lexicon=None):
+    """
+    Sort the distinct words of a text into clearly complex ones and ones
+    the model should judge; everything else is common and dropped.
+
+    Returns (flagged, ambiguous). flagged lists (word, zipf, syllables);
+    ambiguous lists (word, sentence) with the first sentence using the
+    word. Capitalized words inside a sentence are taken as names and
+    skipped, as are acronyms.
+    """
+    lexicon = lexicon if lexicon is not None else load_lexicon()
+    flagged = []
+    ambiguous = []
+    seen = set()
+
+    for sentence in split_sentences(text):
+        for position, match in enumerate(WORD_RE.finditer(sentence)):
+            word = match.group()
+            if len(word) < MIN_LENGTH or word.isupper() or (position and word[0].isupper()):
+                continue
+            lower = word.lower()
+            if lower in seen:
+                continue
+            seen.add(lower)
+
+            score, zipf, syllables = difficulty(lower, lexicon)
+            if score >= COMPLEX:
+                flagged.append((word, zipf, syllables))
+            elif score >= AMBIGUOUS:
+                ambiguous.append((word, sentence))
+
+    return flagged, ambiguous
@@ -0,0 +1,156 @@
+"""Content-addressed cache for chat completion responses."""
+from collections import OrderedDict
+from concurrent.futures import Future
+import hashlib
+import json
+import threading
+import time
+
+
+def cache_key(model, messages, response_format):
+    """Hash everything that determines a completion into a stable key."""
+    payload = json.dumps(
+        {"model": model, "messages": messages, "response_format": response_format},
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class LRUCache:
+    """Thread-safe in-memory LRU with a maximum size and per-entry TTL."""
+
+    def __init__(self, max_entries=256, ttl=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """Return the cached value, or None if missing or expired."""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            value, stored_at = entry
+            if self.ttl is not None and time.time() - stored_at > self.ttl:
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, stored_at=None):
+        """Store a value, evicting the least recently used entries if full."""
+        with self.lock:
+            self.entries[key] = (value, stored_at or time.time())
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class SingleFlight:
+    """
+    Collapse concurrent calls that share a key into one.
+
+    The first caller for a key runs the function. Callers arriving while it
+    runs wait for it and get the same return value, or the same exception.
+    The key is forgotten as soon as the call finishes, so later callers start
+    a fresh one.
+    """
+
+    def __init__(self):
+        self.calls = {}
+        self.lock = threading.Lock()
+
+    def do(self, key, function):
+        """Return (result, shared), where shared is True if another caller ran function."""
+        with self.lock:
+            future = self.calls.get(key)
+            leader = future is None
+            if leader:
+                future = self.calls[key] = Future()
+
+        if not leader:
+            return future.result(), True
+
+        try:
+            result = function()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            with self.lock:
+                del self.calls[key]
+
+    def __len__(self):
+        return len(self.calls)
+
+
+class ResponseCache:
+    """
+    Two-tier completion cache: an in-process LRU in front of a SQLite table.
+
+    Entries older than ttl seconds are ignored by both tiers.
+    """
+
+    def __init__(self, db, max_entries=256, ttl=86400):
+        self.db = db
+        self.ttl = ttl
+        self.memory = LRUCache(max_entries, ttl)
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0}
+        self.stats_lock = threading.Lock()
+
+        self.db.execute('''
+            CREATE TABLE IF NOT EXISTS llm_cache (
+                key TEXT PRIMARY KEY,
+                response TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )
+        ''')
+
+    def count(self, stat):
+        with self.stats_lock:
+            self.stats[stat] += 1
+
+    def get(self, key):
+        """Return the cached response for key, or None on a miss."""
+        response = self.memory.get(key)
+        if response is not None:
+            self.count("memory_hits")
+            return response
+
+        row = self.db.fetchone('SELECT response, created_at FROM llm_cache WHERE key = ?', (key,))
+
+        if row is not None and (self.ttl is None or time.time() - row['created_at'] <= self.ttl):
+            # Promote to the memory tier, keeping the original age
+            self.memory.set(key, row['response'], row['created_at'])
+            self.count("disk_hits")
+            return row['response']
+
+        self.count("misses")
+        return None
+
+    def set(self, key, response):
+        """Store a response in both tiers."""
+        now = time.time()
+        self.memory.set(key, response, now)
+        self.db.execute(
+            'INSERT OR REPLACE INTO llm_cache (key, response, created_at) VALUES (?, ?, ?)',
+            (key, response, now),
+        )
+
+    def prune(self):
+        """Delete expired rows from the persistent tier."""
+        if self.ttl is None:
+            return
+        self.db.execute('DELETE FROM llm_cache WHERE created_at < ?', (time.time() - self.ttl,))
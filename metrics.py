@@ -0,0 +1,197 @@
+"""
+Minimal in-process metrics with Prometheus text-format output.
+
+Under several worker processes, give every Registry the same directory:
+each process then writes snapshots of its values there, and render() sums
+the snapshots of all of them, including workers that have since exited, so
+counters keep rising whichever worker answers a scrape.
+"""
+from contextlib import contextmanager
+import bisect
+import glob
+import json
+import os
+import threading
+import time
+
+# Latency buckets in seconds, from fast SQLite queries up to slow LLM calls
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (
+        (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in pairs
+    )
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = 'untyped'
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.lock = threading.Lock()
+
+    def key(self, labels):
+        return tuple(labels.get(name, '') for name in self.labels)
+
+    def render(self, values=None):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        lines.extend(self.samples(self.collect() if values is None else values))
+        return '\n'.join(lines)
+
+    def combine(self, a, b):
+        """Sum two values of one label set, as collected from different processes."""
+        return a + b
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labels=()):
+        super().__init__(name, documentation, labels)
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def collect(self):
+        with self.lock:
+            return dict(self.values)
+
+    def samples(self, values):
+        return [f'{self.name}{format_labels(self.labels, key)} {format_value(value)}' for key, value in sorted(values.items())]
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+        self.values = {}
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            counts, total = self.values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.values[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe how long the block takes, even if it raises."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def collect(self):
+        with self.lock:
+            return {key: (list(counts), total) for key, (counts, total) in self.values.items()}
+
+    def combine(self, a, b):
+        return [x + y for x, y in zip(a[0], b[0])], a[1] + b[1]
+
+    def samples(self, values):
+        lines = []
+        for key, (counts, total) in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                labels = format_labels(self.labels, key, [('le', format_value(bound))])
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            lines.append(f'{self.name}_sum{format_labels(self.labels, key)} {format_value(total)}')
+            lines.append(f'{self.name}_count{format_labels(self.labels, key)} {cumulative}')
+        return lines
+
+
+class CallbackMetric(Metric):
+    """Metric whose values are read from a callback when metrics are scraped."""
+
+    def __init__(self, name, documentation, labels, callback, kind='gauge'):
+        super().__init__(name, documentation, labels)
+        self.callback = callback
+        self.kind = kind
+
+    def collect(self):
+        return dict(self.callback())
+
+    def samples(self, values):
+        return [f'{self.name}{format_labels(self.labels, key)} {format_value(value)}' for key, value in sorted(values.items())]
+
+
+class Registry:
+    def __init__(self, directory=None):
+        self.metrics = []
+        # Shared with the other worker processes, if any
+        self.directory = directory
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labels=()):
+        return self.register(Counter(name, documentation, labels))
+
+    def histogram(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labels, buckets))
+
+    def callback(self, name, documentation, labels, callback, kind='gauge'):
+        return self.register(CallbackMetric(name, documentation, labels, callback, kind))
+
+    def write_snapshot(self):
+        """Save this process's values to the shared directory, replacing its last snapshot."""
+        snapshot = {
+            metric.name: [[list(key), value] for key, value in metric.collect().items()]
+            for metric in self.metrics
+        }
+        path = os.path.join(self.directory, f'{os.getpid()}.json')
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(snapshot, f)
+        os.replace(path + '.tmp', path)
+
+    def combined_values(self):
+        """Values of every metric summed over the snapshots of all processes."""
+        self.write_snapshot()
+        values = {metric.name: {} for metric in self.metrics}
+        by_name = {metric.name: metric for metric in self.metrics}
+        for path in glob.glob(os.path.join(self.directory, '*.json')):
+            try:
+                with open(path, encoding='utf-8') as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError):
+                # Removed or being replaced while we read it
+                continue
+            for name, samples in snapshot.items():
+                if name not in by_name:
+                    continue
+                merged = values[name]
+                for key, value in samples:
+                    key = tuple(key)
+                    merged[key] = by_name[name].combine(merged[key], value) if key in merged else value
+        return values
+
+    def render(self):
+        """Return every metric in the Prometheus text exposition format."""
+        if self.directory is None:
+            return '\n'.join(metric.render() for metric in self.metrics) + '\n'
+        values = self.combined_values()
+        return '\n'.join(metric.render(values[metric.name]) for metric in self.metrics) + '\n'
@@ -0,0 +1,161 @@
+"""
+Local stand-in for the OpenAI chat completions endpoint, for benchmarks.
+
+Answers POST /v1/chat/completions with canned structured-output JSON built
+from the requested schema, after a configurable latency and jitter. Phrases
+in the analyzer responses are taken from the essay in the request, so span
+resolution has real work to do. Streaming requests get SSE chunks.
+
+Run it on its own and point the app at it:
+
+    python mock_openai.py --port 8001
+    OPENAI_BASE_URL=http://127.0.0.1:8001/v1 python chatgpt_api.py
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import argparse
+import json
+import random
+import re
+import threading
+import time
+
+ESSAY_TEXT = (
+    "Cells are the basic unit of life. Mitochondria produce most of the energy a cell needs, "
+    "while the nucleus stores its genetic information. "
+)
+
+
+class MockConfig:
+    def __init__(self, latency=0.2, jitter=0.05, findings=3, essay_words=400, stream_chunk=16):
+        self.latency = latency
+        self.jitter = jitter
+        self.findings = findings
+        self.essay_words = essay_words
+        self.stream_chunk = stream_chunk
+
+
+def canned_response(request, config):
+    """Build a JSON answer that satisfies the request's json_schema."""
+    schema = request.get('response_format', {}).get('json_schema', {}).get('schema', {})
+    essay = ''
+    for message in request.get('messages', []):
+        if message.get('content', '').startswith('Essay:'):
+            essay = message['content'][len('Essay:'):]
+
+    words = essay.split()
+    answer = {}
+    for field in schema.get('properties', {}):
+        if field == 'final_answer':
+            repeats = config.essay_words // len(ESSAY_TEXT.split()) + 1
+            answer[field] = ' '.join((ESSAY_TEXT * repeats).split()[:config.essay_words])
+        elif field.endswith('_context'):
+            # Four-word phrases picked from the essay that was sent
+            phrases = []
+            for _ in range(config.findings if len(words) >= 4 else 0):
+                start = random.randrange(len(words) - 3)
+                phrases.append(' '.join(words[start:start + 4]))
+            answer[field] = phrases
+        else:
+            answer[field] = [f"Canned {field} text."] * config.findings
+    return json.dumps(answer)
+
+
+def usage_for(request, content):
+    prompt = sum(len(message.get('content', '')) for message in request.get('messages', []))
+    return {
+        "prompt_tokens": prompt // 4,
+        "completion_tokens": len(content) // 4,
+        "total_tokens": (prompt + len(content)) // 4,
+    }
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    config = MockConfig()
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        if not re.search(r'/chat/completions$', self.path):
+            self.send_error(404)
+            return
+
+        request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+        time.sleep(max(0.0, self.config.latency + random.uniform(-self.config.jitter, self.config.jitter)))
+        content = canned_response(request, self.config)
+
+        if request.get('stream'):
+            self.stream(request, content)
+            return
+
+        body = json.dumps({
+            "id": "chatcmpl-mock",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get('model', 'mock'),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+            }],
+            "usage": usage_for(request, content),
+        }).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def stream(self, request, content):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+
+        def send(payload):
+            self.wfile.write(f"data: {json.dumps(payload)}\n\n".encode('utf-8'))
+            self.wfile.flush()
+
+        base = {"id": "chatcmpl-mock", "object": "chat.completion.chunk", "created": int(time.time()),
+                "model": request.get('model', 'mock')}
+        for i in range(0, len(content), self.config.stream_chunk):
+            send(dict(base, choices=[{"index": 0, "delta": {"content": content[i:i + self.config.stream_chunk]}}]))
+        if request.get('stream_options', {}).get('include_usage'):
+            send(dict(base, choices=[], usage=usage_for(request, content)))
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.close_connection = True
+
+
+def start_server(config, host='127.0.0.1', port=0):
+    """Start the mock server in a daemon thread and return it (see server_port)."""
+    handler = type('ConfiguredMockHandler', (MockHandler,), {'config': config})
+    # The default listen backlog of 5 drops connections under benchmark load
+    server_class = type('MockServer', (ThreadingHTTPServer,), {'request_queue_size': 1024})
+    server = server_class((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='mock-openai', daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--latency', type=float, default=0.2, help="seconds before each response")
+    parser.add_argument('--jitter', type=float, default=0.05, help="+/- random seconds added to latency")
+    parser.add_argument('--findings', type=int, default=3, help="findings per analyzer response")
+    parser.add_argument('--essay-words', type=int, default=400, help="length of generated essays")
+    args = parser.parse_args()
+
+    config = MockConfig(args.latency, args.jitter, args.findings, args.essay_words)
+    server = start_server(config, args.host, args.port)
+    print(f"Mock OpenAI API on http://{args.host}:{server.server_port}/v1")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
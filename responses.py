@@ -0,0 +1,115 @@
+"""Fast JSON encoding and decoding for Flask, and negotiated response compression."""
+import gzip
+import zlib
+
+import brotli
+from flask.json.provider import JSONProvider
+import jiter
+import orjson
+
+# Bodies smaller than this go out uncompressed; the headers would eat the saving
+COMPRESS_MIN_SIZE = 1024
+
+COMPRESSIBLE_TYPES = ('application/json', 'text/html', 'text/plain', 'text/css', 'application/javascript')
+
+# Preferred first when the client accepts both equally
+ENCODINGS = ('br', 'gzip')
+
+# Fast settings: most of the size win for a fraction of the CPU of the maximums
+BROTLI_QUALITY = 4
+GZIP_LEVEL = 6
+
+
+def dumps(obj):
+    """Encode obj as UTF-8 JSON bytes with orjson."""
+    return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+
+
+def loads(data):
+    """Decode JSON from str or bytes with jiter."""
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    return jiter.from_json(data)
+
+
+class FastJSONProvider(JSONProvider):
+    """Flask JSON provider backed by orjson for jsonify and jiter for request bodies."""
+
+    mimetype = 'application/json'
+
+    def dumps(self, obj, **kwargs):
+        return dumps(obj).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        return loads(s)
+
+    def response(self, *args, **kwargs):
+        return self._app.response_class(dumps(self._prepare_response_obj(args, kwargs)), mimetype=self.mimetype)
+
+
+def negotiate_encoding(accept_encodings):
+    """Best encoding the client accepts out of ENCODINGS, or None."""
+    return accept_encodings.best_match(ENCODINGS)
+
+
+def add_vary(response, header):
+    if header not in response.vary:
+        response.vary.add(header)
+
+
+def weaken_etag(response):
+    """A compressed body is no longer byte-identical to the uncompressed one."""
+    etag, weak = response.get_etag()
+    if etag is not None and not weak:
+        response.set_etag(etag, weak=True)
+
+
+def compress_response(response, accept_encodings, min_size=COMPRESS_MIN_SIZE):
+    """
+    Compress a response body with the best encoding the client accepts.
+
+    Small, already encoded and non-text bodies are left alone. Streamed
+    bodies are compressed chunk by chunk as they are sent.
+    """
+    if response.mimetype not in COMPRESSIBLE_TYPES or 'Content-Encoding' in response.headers:
+        return response
+    if response.status_code < 200 or response.status_code in (204, 304):
+        return response
+
+    add_vary(response, 'Accept-Encoding')
+    encoding = negotiate_encoding(accept_encodings)
+    if encoding is None:
+        return response
+
+    if response.is_streamed:
+        response.response = compress_chunks(response.response, encoding)
+        response.headers.pop('Content-Length', None)
+    else:
+        body = response.get_data()
+        if len(body) < min_size:
+            return response
+        response.set_data(brotli.compress(body, quality=BROTLI_QUALITY) if encoding == 'br' else
+                          gzip.compress(body, GZIP_LEVEL))
+
+    response.headers['Content-Encoding'] = encoding
+    weaken_etag(response)
+    return response
+
+
+def compress_chunks(chunks, encoding):
+    """Compress an iterable of str/bytes chunks into a stream of the given encoding."""
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        compress, finish = compressor.process, compressor.finish
+    else:
+        # wbits 31 writes a gzip header and trailer
+        compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+        compress, finish = compressor.compress, compressor.flush
+
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        data = compress(chunk)
+        if data:
+            yield data
+    yield finish()
@@ -0,0 +1,143 @@
+"""Local BM25 retrieval over a source text, used to keep prompts small."""
+from collections import Counter, defaultdict
+import hashlib
+import math
+import re
+
+from llm_cache import LRUCache
+
+WORD_RE = re.compile(r"[a-z0-9]+(?:'[a-z]+)?")
+SENTENCE_RE = re.compile(r'[^.!?\n]+[.!?]*')
+
+STOPWORDS = frozenset('''
+    a an and are as at be been but by can did do does for from had has have he her his how i if in into is it its
+    itself me more most my no not of on or our she so some such than that the their them then there these they
+    this those to too very was we were what when where which while who why will with would you your
+'''.split())
+
+# Indexes for recently seen source texts, keyed by a hash of the text
+index_cache = LRUCache(max_entries=32, ttl=60 * 60)
+
+
+def estimate_tokens(text):
+    """Rough token count for English text (about four characters per token)."""
+    return (len(text) + 3) // 4
+
+
+def tokenize(text):
+    return [word for word in WORD_RE.findall(text.lower()) if word not in STOPWORDS]
+
+
+def split_sentences(text):
+    """Split text into sentences for use as retrieval queries."""
+    return [match.group().strip() for match in SENTENCE_RE.finditer(text) if match.group().strip()]
+
+
+def chunk_passages(text, passage_words=120, overlap=30):
+    """Split text into overlapping windows of words, returned as (start, end) offsets."""
+    words = [match.span() for match in re.finditer(r'\S+', text)]
+    if not words:
+        return []
+
+    passages = []
+    step = passage_words - overlap
+    for first in range(0, len(words), step):
+        last = min(first + passage_words, len(words)) - 1
+        passages.append((words[first][0], words[last][1]))
+        if last == len(words) - 1:
+            break
+    return passages
+
+
+class BM25Index:
+    """Okapi BM25 over a list of passages, stored as an inverted index."""
+
+    def __init__(self, text, k1=1.5, b=0.75):
+        self.text = text
+        self.k1 = k1
+        self.b = b
+        self.passages = chunk_passages(text)
+        self.postings = defaultdict(list)
+        self.lengths = []
+
+        for passage_id, (start, end) in enumerate(self.passages):
+            terms = tokenize(text[start:end])
+            self.lengths.append(len(terms))
+            for term, count in Counter(terms).items():
+                self.postings[term].append((passage_id, count))
+
+        self.average_length = sum(self.lengths) / len(self.lengths) if self.lengths else 0
+        total = len(self.passages)
+        self.idf = {
+            term: math.log(1 + (total - len(posting) + 0.5) / (len(posting) + 0.5))
+            for term, posting in self.postings.items()
+        }
+
+    def search(self, query):
+        """Return passage ids ranked by BM25 score, best first (matches only)."""
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for passage_id, count in self.postings[term]:
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[passage_id] / self.average_length)
+                scores[passage_id] += idf * count * (self.k1 + 1) / (count + norm)
+        return sorted(scores, key=lambda passage_id: (-scores[passage_id], passage_id))
+
+    def passage(self, passage_id):
+        start, end = self.passages[passage_id]
+        return self.text[start:end]
+
+
+def get_index(text):
+    """Return the BM25 index for a source text, building it at most once."""
+    key = hashlib.sha256(text.encode('utf-8')).hexdigest()
+    index = index_cache.get(key)
+    if index is None:
+        index = BM25Index(text)
+        index_cache.set(key, index)
+    return index
+
+
+def select_passages(text, queries, token_budget):
+    """
+    Return the parts of text most relevant to the queries, within token_budget.
+
+    Texts already under budget are returned unchanged. Otherwise the queries
+    take turns claiming their next best passage until the budget is spent, so
+    every query gets some support. Passages are returned in source order.
+    """
+    if not text or estimate_tokens(text) <= token_budget:
+        return text
+
+    index = get_index(text)
+    rankings = [iter(index.search(query)) for query in queries]
+    chosen = set()
+    used = 0
+
+    while rankings:
+        for ranking in list(rankings):
+            passage_id = next((p for p in ranking if p not in chosen), None)
+            if passage_id is None:
+                rankings.remove(ranking)
+                continue
+            cost = estimate_tokens(index.passage(passage_id))
+            if used + cost > token_budget:
+                rankings = []
+                break
+            chosen.add(passage_id)
+            used += cost
+
+    if not chosen:
+        # Nothing matched; fall back to the start of the text
+        return text[:token_budget * 4]
+
+    # Merge overlapping passages so the excerpt reads in source order
+    spans = []
+    for start, end in sorted(index.passages[p] for p in chosen):
+        if spans and start <= spans[-1][1]:
+            spans[-1] = (spans[-1][0], max(end, spans[-1][1]))
+        else:
+            spans.append((start, end))
+    return "\n...\n".join(text[start:end] for start, end in spans)
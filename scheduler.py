@@ -0,0 +1,179 @@
+"""Shared scheduling of upstream LLM calls: rate limits, concurrency, priority and retries."""
+from email.utils import parsedate_to_datetime
+import heapq
+import itertools
+import random
+import threading
+import time
+
+import openai
+
+# Lower numbers go first
+INTERACTIVE = 0
+BACKGROUND = 1
+
+# Failures worth trying again; APITimeoutError is a kind of APIConnectionError
+RETRYABLE_ERRORS = (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError)
+
+
+class TokenBucket:
+    """Refills continuously at `per_minute`, holding at most one minute's worth."""
+
+    def __init__(self, per_minute):
+        self.rate = per_minute / 60
+        self.capacity = per_minute
+        self.level = per_minute
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount, now):
+        """Seconds until `amount` can be taken (requests bigger than the bucket wait for a full one)."""
+        self.refill(now)
+        amount = min(amount, self.capacity)
+        return 0 if self.level >= amount else (amount - self.level) / self.rate
+
+    def take(self, amount):
+        # May go negative when a call turns out to cost more than estimated
+        self.level -= amount
+
+
+def retry_after(error):
+    """Seconds the server asked us to wait before retrying, or None."""
+    response = getattr(error, 'response', None)
+    if response is None:
+        return None
+    headers = response.headers
+    try:
+        if headers.get('retry-after-ms'):
+            return float(headers['retry-after-ms']) / 1000
+        value = headers.get('retry-after')
+        if not value:
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class UpstreamScheduler:
+    """
+    Admits upstream calls under requests/min and tokens/min budgets and a
+    concurrency cap, in priority order (FIFO within a priority).
+
+    Calls that fail with a rate limit, timeout, connection or 5xx error are
+    retried with jittered exponential backoff, or after the server's
+    Retry-After. A 429 pauses every caller, not just the one that got it, so
+    a burst backs off together instead of cascading into more 429s.
+    """
+
+    def __init__(self, requests_per_minute, tokens_per_minute, max_concurrency, max_retries=4, base_delay=1.0,
+                 max_delay=60.0, on_wait=None, on_retry=None):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        # Called as on_wait(priority, seconds) once a call is admitted
+        self.on_wait = on_wait
+        # Called as on_retry(error, delay) before each retry
+        self.on_retry = on_retry
+        self.active = 0
+        self.waiting = []
+        self.sequence = itertools.count()
+        self.paused_until = 0.0
+        self.condition = threading.Condition()
+
+    def acquire(self, tokens, priority=BACKGROUND):
+        """Block until this call may start, then take its share of every budget."""
+        ticket = (priority, next(self.sequence))
+        start = time.monotonic()
+        with self.condition:
+            heapq.heappush(self.waiting, ticket)
+            try:
+                while True:
+                    delay = None
+                    if self.waiting[0] == ticket and self.active < self.max_concurrency:
+                        now = time.monotonic()
+                        delay = max(
+                            self.paused_until - now,
+                            self.requests.wait_time(1, now),
+                            self.tokens.wait_time(tokens, now)
+                        )
+                        if delay <= 0:
+                            break
+                    self.condition.wait(delay)
+            except BaseException:
+                self.waiting.remove(ticket)
+                heapq.heapify(self.waiting)
+                self.condition.notify_all()
+                raise
+
+            heapq.heappop(self.waiting)
+            self.requests.take(1)
+            self.tokens.take(tokens)
+            self.active += 1
+            # Let the next caller in line check whether it can start too
+            self.condition.notify_all()
+
+        if self.on_wait is not None:
+            self.on_wait(priority, time.monotonic() - start)
+
+    def release(self, tokens, used=None):
+        """Free the call's slot, correcting the token budget if its real usage is known."""
+        with self.condition:
+            self.active -= 1
+            if used is not None:
+                self.tokens.take(used - tokens)
+            self.condition.notify_all()
+
+    def backoff(self, error, attempt):
+        """Delay before retry number `attempt` (0-based) of a failed call."""
+        delay = retry_after(error)
+        if delay is None:
+            ceiling = min(self.max_delay, self.base_delay * 2 ** attempt)
+            delay = random.uniform(ceiling / 2, ceiling)
+        if isinstance(error, openai.RateLimitError):
+            with self.condition:
+                self.paused_until = max(self.paused_until, time.monotonic() + delay)
+        return delay
+
+    def call(self, function, tokens, priority=BACKGROUND, used_tokens=None, hold=False):
+        """
+        Run function() once admitted and return its result, retrying
+        retryable errors. used_tokens(result), if given, returns the call's
+        real token usage so the budget can be corrected.
+
+        With hold=True the slot stays taken after function() succeeds, for
+        calls that keep the upstream busy after returning (streams); the
+        caller must then release(tokens, used) when it is done.
+        """
+        attempt = 0
+        while True:
+            self.acquire(tokens, priority)
+            used = None
+            held = False
+            try:
+                result = function()
+                if used_tokens is not None:
+                    used = used_tokens(result)
+                held = hold
+                return result
+            except RETRYABLE_ERRORS as e:
+                if attempt >= self.max_retries:
+                    raise
+                error = e
+            finally:
+                if not held:
+                    self.release(tokens, used)
+
+            delay = self.backoff(error, attempt)
+            if self.on_retry is not None:
+                self.on_retry(error, delay)
+            time.sleep(delay)
+            attempt += 1
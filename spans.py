@@ -0,0 +1,236 @@
+"""Locate analyzer phrases in an essay and report offsets into the original text."""
+from collections import Counter, deque
+import re
+
+# Minimum share of a phrase's words that must appear in a window of the essay
+# for the fuzzy fallback to accept it.
+FUZZY_THRESHOLD = 0.6
+
+WORD_RE = re.compile(r'\w+', re.ASCII)
+
+# Dropped rather than turned into spaces so "isn't" normalizes to "isnt"
+APOSTROPHES = "'\u2019"
+
+
+def normalize_with_offsets(text):
+    """
+    Lowercase text, drop apostrophes and turn other special characters into
+    single spaces.
+
+    Returns the normalized string and a list mapping every normalized
+    character back to its index in the original text.
+    """
+    chars = []
+    offsets = []
+    for index, ch in enumerate(text):
+        for low in ch.lower():
+            if low.isascii() and (low.isalnum() or low == '_'):
+                chars.append(low)
+                offsets.append(index)
+            elif low in APOSTROPHES:
+                continue
+            elif chars and chars[-1] != ' ':
+                # Whitespace and punctuation both separate words
+                chars.append(' ')
+                offsets.append(index)
+    return ''.join(chars), offsets
+
+
+def normalize_phrase(phrase):
+    """Normalize a phrase the same way as the essay, without offsets."""
+    return normalize_with_offsets(phrase)[0].strip()
+
+
+class PhraseMatcher:
+    """Aho-Corasick automaton that finds many phrases in a single scan."""
+
+    def __init__(self, patterns):
+        self.patterns = list(patterns)
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+
+        for pattern_id, pattern in enumerate(self.patterns):
+            state = 0
+            for ch in pattern:
+                if ch not in self.goto[state]:
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append([])
+                    self.goto[state][ch] = len(self.goto) - 1
+                state = self.goto[state][ch]
+            self.output[state].append(pattern_id)
+
+        # Breadth-first pass to fill in failure links
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fallback = self.fail[state]
+                while fallback and ch not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[next_state] = self.goto[fallback].get(ch, 0)
+                self.output[next_state] = self.output[next_state] + self.output[self.fail[next_state]]
+
+    def iter_matches(self, text):
+        """Yield (pattern_id, start, end) for every occurrence in text."""
+        state = 0
+        for index, ch in enumerate(text):
+            while state and ch not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(ch, 0)
+            for pattern_id in self.output[state]:
+                yield pattern_id, index + 1 - len(self.patterns[pattern_id]), index + 1
+
+
+def is_word_boundary(text, start, end):
+    """Return True if text[start:end] does not cut a word in half."""
+    before = start == 0 or not text[start - 1].isalnum()
+    after = end == len(text) or not text[end].isalnum()
+    return before and after
+
+
+def fuzzy_find(tokens, phrase_words):
+    """
+    Find the window of essay tokens sharing the most words with a phrase.
+
+    tokens is a list of (word, start, end) tuples. Returns the (start, end)
+    slice of the normalized text, trimmed to the first and last shared word,
+    or None if no window reaches FUZZY_THRESHOLD.
+    """
+    size = len(phrase_words)
+    if not size or not tokens:
+        return None
+
+    wanted = Counter(phrase_words)
+    window = Counter()
+    shared = 0
+    best_shared = 0
+    best_end = 0
+
+    # Slide a window of len(phrase_words) tokens, keeping the shared word
+    # count up to date in O(1) per step
+    for index, (word, _, _) in enumerate(tokens):
+        window[word] += 1
+        if window[word] <= wanted[word]:
+            shared += 1
+        if index >= size:
+            old = tokens[index - size][0]
+            if window[old] <= wanted[old]:
+                shared -= 1
+            window[old] -= 1
+        if shared > best_shared:
+            best_shared = shared
+            best_end = index + 1
+
+    if best_shared / size < FUZZY_THRESHOLD:
+        return None
+
+    matched = [token for token in tokens[max(0, best_end - size):best_end] if token[0] in wanted]
+    return matched[0][1], matched[-1][2]
+
+
+def resolve_spans(text, phrases):
+    """
+    Resolve every phrase to (startIndex, endIndex) in the original text.
+
+    The text is normalized once and all phrases are matched in one pass.
+    Exact matches on word boundaries win over ones inside a word; phrases
+    with no exact match fall back to a fuzzy word-overlap search. Phrases
+    that can't be located map to None.
+    """
+    normalized, offsets = normalize_with_offsets(text)
+    normalized_phrases = [normalize_phrase(phrase) for phrase in phrases]
+
+    unique = sorted({phrase for phrase in normalized_phrases if phrase})
+    found = {}
+    for pattern_id, start, end in PhraseMatcher(unique).iter_matches(normalized):
+        pattern = unique[pattern_id]
+        boundary = is_word_boundary(normalized, start, end)
+        if pattern not in found or (boundary and not found[pattern][2]):
+            found[pattern] = (start, end, boundary)
+
+    tokens = None
+    spans = []
+    for phrase in normalized_phrases:
+        if not phrase:
+            spans.append(None)
+            continue
+
+        if phrase in found:
+            start, end, _ = found[phrase]
+        else:
+            if tokens is None:
+                tokens = [(m.group(), m.start(), m.end()) for m in WORD_RE.finditer(normalized)]
+            match = fuzzy_find(tokens, WORD_RE.findall(phrase))
+            if match is None:
+                spans.append(None)
+                continue
+            start, end = match
+
+        spans.append((offsets[start], offsets[end - 1] + 1))
+
+    return spans
+
+
+# A paragraph is a run of text between newlines, trimmed of surrounding whitespace
+PARAGRAPH_RE = re.compile(r'\S(?:[^\n]*\S)?')
+
+
+def split_paragraphs(text):
+    """Return the (start, end) span of every non-blank paragraph in text."""
+    return [(match.start(), match.end()) for match in PARAGRAPH_RE.finditer(text)]
+
+
+def segment_spans(spans, length=None):
+    """
+    Split text into flat, non-overlapping segments by sweeping over spans.
+
+    spans is an iterable of (start, end, edit_id, edit_type). Returns a
+    list of {"start", "end", "ids", "types"} dicts in text order, where ids
+    and types list every span covering the whole segment (empty for plain
+    text). Segments cover [0, length) without gaps, or up to the last span
+    end if length is None; spans are clipped to length and empty ones are
+    skipped. Runs in O(n log n) plus the size of the output.
+    """
+    boundaries = []
+    for start, end, edit_id, edit_type in spans:
+        if start is None or end is None:
+            continue
+        start = max(0, start)
+        if length is not None:
+            end = min(end, length)
+        if start < end:
+            # Ends sort before starts at the same offset so touching spans don't overlap
+            boundaries.append((start, 1, edit_id, edit_type))
+            boundaries.append((end, 0, edit_id, edit_type))
+    boundaries.sort(key=lambda boundary: (boundary[0], boundary[1]))
+
+    if length is None:
+        length = boundaries[-1][0] if boundaries else 0
+
+    segments = []
+    active = {}
+    position = 0
+
+    def close(end):
+        if position < end:
+            ids = sorted(active)
+            segments.append({
+                "start": position,
+                "end": end,
+                "ids": ids,
+                "types": sorted({active[edit_id] for edit_id in ids}),
+            })
+
+    for offset, opening, edit_id, edit_type in boundaries:
+        if offset != position:
+            close(offset)
+            position = offset
+        if opening:
+            active[edit_id] = edit_type
+        else:
+            active.pop(edit_id, None)
+    close(length)
+    return segments
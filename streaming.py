@@ -0,0 +1,86 @@
+"""Helpers for streaming structured-output completions to the browser."""
+import json
+import re
+
+
+def sse_event(event, data):
+    """Format one Server-Sent Event with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+class JSONStringFieldExtractor:
+    """
+    Pull the value of one string field out of a JSON object as it streams in.
+
+    Feed it the raw chunks of a structured-output completion; each call to
+    feed() returns the newly decoded part of the field's value (possibly an
+    empty string). Escape sequences split across chunks are held back until
+    they are complete.
+    """
+
+    def __init__(self, field):
+        self.key_re = re.compile(r'"%s"\s*:\s*"' % re.escape(field))
+        self.buffer = ''
+        self.state = 'seek'
+
+    @property
+    def done(self):
+        return self.state == 'done'
+
+    def feed(self, chunk):
+        self.buffer += chunk
+
+        if self.state == 'seek':
+            match = self.key_re.search(self.buffer)
+            if match is None:
+                return ''
+            self.buffer = self.buffer[match.end():]
+            self.state = 'value'
+
+        if self.state != 'value':
+            return ''
+
+        out = []
+        i = 0
+        buffer = self.buffer
+        while i < len(buffer):
+            ch = buffer[i]
+            if ch == '"':
+                self.state = 'done'
+                i += 1
+                break
+            if ch != '\\':
+                # Copy the run of plain characters in one slice
+                j = i
+                while j < len(buffer) and buffer[j] not in '"\\':
+                    j += 1
+                out.append(buffer[i:j])
+                i = j
+                continue
+
+            length = self.escape_length(buffer, i)
+            if length is None:
+                # Incomplete escape; wait for the next chunk
+                break
+            out.append(json.loads('"' + buffer[i:i + length] + '"'))
+            i += length
+
+        self.buffer = buffer[i:]
+        return ''.join(out)
+
+    @staticmethod
+    def escape_length(buffer, i):
+        """Return the length of the escape starting at i, or None if incomplete."""
+        if i + 1 >= len(buffer):
+            return None
+        if buffer[i + 1] != 'u':
+            return 2
+        if i + 6 > len(buffer):
+            return None
+        # A high surrogate must be decoded together with its low surrogate
+        if 0xD800 <= int(buffer[i + 2:i + 6], 16) <= 0xDBFF:
+            if i + 12 > len(buffer):
+                return None
+            if buffer[i + 6:i + 8] == '\\u':
+                return 12
+        return 6
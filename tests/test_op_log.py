@@ -0,0 +1,113 @@
+"""
+Response-box op log: every version must replay to the text that produced it,
+also when several workers write to the same session.
+
+Each worker process has its own tracked_documents cache; the tests swap
+caches between requests to play the part of different workers.
+"""
+import os
+import sys
+import tempfile
+import uuid
+
+import pytest
+
+os.environ.setdefault('OPENAI_API_KEY', 'test')
+os.environ['SESSION_HEADER'] = '1'
+
+# Import the app from a scratch directory so the tests get their own edits.db
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(tempfile.mkdtemp(prefix='rewrite-tests-'))
+
+import chatgpt_api  # noqa: E402
+from llm_cache import LRUCache  # noqa: E402
+
+
+@pytest.fixture
+def session():
+    return {'X-Session-Id': uuid.uuid4().hex}
+
+
+@pytest.fixture
+def workers(monkeypatch):
+    """Return a function that makes the next request run as worker 0, 1, ..."""
+    caches = [LRUCache(max_entries=16), LRUCache(max_entries=16)]
+
+    def use(worker):
+        monkeypatch.setattr(chatgpt_api, 'tracked_documents', caches[worker])
+    return use
+
+
+def track(client, session, text):
+    response = client.post('/track-edits', json={'responseBoxText': text}, headers=session)
+    assert response.status_code == 200, response.json
+    return response.json['version']
+
+
+def document(client, session, version=None):
+    query = '' if version is None else f'?version={version}'
+    return client.get('/get-document' + query, headers=session).json
+
+
+def assert_replays(client, session, posted):
+    """Every version replays to the last text posted that returned it."""
+    expected = {}
+    for version, text in posted:
+        expected[version] = text
+    for version, text in expected.items():
+        assert document(client, session, version)['text'] == text
+    assert document(client, session)['text'] == posted[-1][1]
+
+
+def test_interleaved_writers(session, workers):
+    client = chatgpt_api.app.test_client()
+    posted = []
+    for worker, text in [(1, 'hello'), (0, 'hello'), (1, 'hello w'), (0, 'hello wo'),
+                         (1, 'hello wor'), (1, 'hello world'), (0, 'hello worl')]:
+        workers(worker)
+        posted.append((track(client, session, text), text))
+    assert_replays(client, session, posted)
+
+
+def test_typing_coalesces_within_one_worker(session, workers):
+    client = chatgpt_api.app.test_client()
+    workers(0)
+    text = ''
+    posted = []
+    for ch in 'Typed one key at a time.':
+        text += ch
+        posted.append((track(client, session, text), text))
+    assert posted[-1][0] == 1
+    assert_replays(client, session, posted)
+
+
+def test_sealed_version_is_not_extended_by_another_worker(session, workers):
+    client = chatgpt_api.app.test_client()
+    workers(0)
+    sealed = track(client, session, 'Draft')
+    workers(1)
+    assert chatgpt_api.seal_document(session['X-Session-Id']) == sealed
+    workers(0)
+    assert track(client, session, 'Draft two') == sealed + 1
+    assert document(client, session, sealed)['text'] == 'Draft'
+
+
+def test_deltas_apply_in_order(session, workers):
+    client = chatgpt_api.app.test_client()
+    workers(0)
+    track(client, session, 'abc')
+
+    def send(deltas):
+        return client.post('/track-edits', json={'deltas': deltas}, headers=session)
+
+    # The second delta starts past the end of the original text
+    response = send([{'start': 3, 'text': 'def'}, {'start': 6, 'text': 'g'}])
+    assert response.status_code == 200, response.json
+    assert document(client, session)['text'] == 'abcdefg'
+
+    # The second delta ends past the end of the text the first one left
+    response = send([{'start': 0, 'end': 7, 'text': ''}, {'start': 2, 'end': 3, 'text': 'X'}])
+    assert response.status_code == 400
+    assert document(client, session)['text'] == 'abcdefg'
+    workers(1)
+    assert document(client, session)['text'] == 'abcdefg'